@@ -0,0 +1,24 @@
+import importlib.util
+import os
+import pathlib
+
+import pytest
+
+APP_PATH = pathlib.Path(__file__).resolve().parent.parent / "天賦測驗.py"
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """以 bare mode 載入 Streamlit 腳本，測試直接呼叫裡面的函式
+
+    在暫存目錄中執行，避免寫入專案根目錄的 CSV 或 SQLite 檔。
+    """
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        spec = importlib.util.spec_from_file_location("talent_app", APP_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
@@ -0,0 +1,34 @@
+import itertools
+import random
+
+import pytest
+
+
+def brute_force_locked(app, responses, bank):
+    """逐一列舉剩餘題目的所有答法"""
+    remaining = [i for i in range(len(bank)) if i not in responses]
+    profiles = set()
+    for picks in itertools.product(*(list(bank[i]["opts"].values()) for i in remaining)):
+        profiles.add(app.determine_profile(app.calculate_scores({**responses, **dict(zip(remaining, picks))})))
+    return len(profiles) == 1
+
+
+@pytest.mark.parametrize("remaining", [0, 1, 2, 3, 4])
+def test_matches_brute_force(app, remaining):
+    bank = app.questions
+    rng = random.Random(remaining)
+    for _ in range(200):
+        answered = rng.sample(range(len(bank)), len(bank) - remaining)
+        responses = {i: rng.choice(list(bank[i]["opts"].values())) for i in answered}
+        assert app.profile_is_locked(app.calculate_scores(responses), responses, bank) \
+            == brute_force_locked(app, responses, bank)
+
+
+def test_unanswered_bank_is_not_locked(app):
+    assert not app.profile_is_locked(app.calculate_scores({}), {}, app.questions)
+
+
+def test_dominant_answers_lock_early(app):
+    bank = app.questions
+    responses = {i: "D" if i % 2 else "B" for i in range(20)}
+    assert app.profile_is_locked(app.calculate_scores(responses), responses, bank)
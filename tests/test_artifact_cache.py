@@ -0,0 +1,39 @@
+import os
+from contextlib import contextmanager
+
+DIGESTS = [f"{i:02x}" + "0" * 62 for i in range(4)]
+
+
+def fill(app, root, max_bytes):
+    cache = app.SharedArtifactCache(str(root), max_bytes)
+    for digest in DIGESTS:
+        cache.put(digest, b"x" * 8)
+    return cache
+
+
+def test_prune_keeps_total_under_limit(app, tmp_path):
+    cache = fill(app, tmp_path, 1 << 20)
+    cache.max_bytes = 20
+    cache.prune()
+    assert sum(cache.get(d) is not None for d in DIGESTS) * 8 <= 20
+
+
+def test_prune_skips_entries_removed_during_scan(app, tmp_path, monkeypatch):
+    cache = fill(app, tmp_path, 1 << 20)
+    real_scandir = os.scandir
+
+    @contextmanager
+    def racing_scandir(path):
+        # 另一個行程搶先淘汰：列出目錄後、stat 之前檔案就被刪掉
+        with real_scandir(path) as it:
+            entries = list(it)
+        for entry in entries:
+            if not entry.name.startswith("."):
+                os.remove(entry.path)
+        yield iter(entries)
+
+    real_glob = app.glob.glob
+    monkeypatch.setattr(app.glob, "glob", lambda pattern: real_glob(pattern) + [str(tmp_path / "ff")])
+    monkeypatch.setattr(app.os, "scandir", racing_scandir)
+    cache.max_bytes = 1
+    cache.prune()   # 不應拋出 FileNotFoundError
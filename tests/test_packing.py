@@ -0,0 +1,49 @@
+import random
+
+import numpy as np
+import pytest
+
+
+def random_answers(rng, q_count, skip=0.2):
+    return "".join("-" if rng.random() < skip else rng.choice("DBTS") for _ in range(q_count))
+
+
+@pytest.mark.parametrize("q_count", [1, 25, 32, 33, 64])
+def test_pack_round_trip(app, q_count):
+    rng = random.Random(q_count)
+    for _ in range(100):
+        answers = random_answers(rng, q_count)
+        codes, mask = app.pack_answers(answers)
+        assert app.unpack_answers(codes, mask, q_count) == answers
+
+
+def test_pack_answer_array_matches_scalar(app):
+    rng = random.Random(0)
+    # 長度不一的答案：不足的題目視為未作答
+    answers = [random_answers(rng, rng.randint(0, 64)) for _ in range(500)]
+    packed = app.pack_answer_array(answers, 64)
+    for a, row in zip(answers, packed):
+        assert (app.join_packed_words(row["codes"].tolist()), int(row["mask"])) == app.pack_answers(a)
+
+
+@pytest.mark.parametrize("q_count", [25, 64])
+def test_packed_scores_match_counting(app, q_count):
+    rng = random.Random(q_count)
+    answers = [random_answers(rng, q_count) for _ in range(1000)] + ["-" * q_count, "D" * q_count, "S" * q_count]
+    scores = app.packed_scores(app.pack_answer_array(answers, q_count))
+    expected = np.array([[a.count(e) for e in app.PACK_ENERGIES] for a in answers])
+    np.testing.assert_array_equal(scores, expected)
+
+
+@pytest.mark.parametrize("native", [True, False])
+def test_popcount(app, monkeypatch, native):
+    if not native:
+        # NumPy 2.0 之前沒有 bitwise_count，改用查表
+        monkeypatch.delattr(np, "bitwise_count", raising=False)
+    x = np.array([0, 1, 0xFF, 0xFFFFFFFFFFFFFFFF, 0x5555555555555555], dtype=np.uint64)
+    assert app.popcount(x).tolist() == [0, 1, 8, 64, 32]
+
+
+def test_too_many_questions(app):
+    with pytest.raises(ValueError):
+        app.pack_answers("D" * (app.PACKED_MAX_QUESTIONS + 1))
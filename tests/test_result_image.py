@@ -0,0 +1,86 @@
+import io
+
+import matplotlib
+import numpy as np
+import pytest
+from PIL import Image, ImageFont
+
+PCT_SETS = [(25, 25, 25, 25), (60, 20, 10, 10), (10, 10, 40, 40), (0, 0, 0, 100), (28, 16, 20, 36)]
+ANGLE_BINS = 32
+TOLERANCE = 0.05   # 以雷達半徑為單位的平均誤差
+
+
+@pytest.fixture(scope="module")
+def pil_fonts(app):
+    # 測試環境不一定有中文字型；只比較圖形，文字改用 matplotlib 內附的 DejaVu Sans
+    path = matplotlib.get_data_path() + "/fonts/ttf/DejaVuSans.ttf"
+    return {size: ImageFont.truetype(path, round(size * app.PIL_DPI_SCALE)) for size in app.PIL_FONT_SIZES}
+
+
+def near(rgb, color, tol=40):
+    return np.abs(rgb - np.array(color)).sum(axis=2) < tol
+
+
+def radar_profile(app, png):
+    """數據多邊形在各方位的最遠距離，以網格外框的半徑正規化 (與圖片大小、留白無關)"""
+    rgb = np.asarray(Image.open(io.BytesIO(png)).convert("RGB"), dtype=int)
+    grid = near(rgb, app.hex_rgb("#94a3b8"))
+    rows = np.flatnonzero(grid.any(axis=1))
+    # 網格是最長一段連續有灰線的列，上方標頭與它之間有空白
+    band = max(np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1), key=len)
+    grid[:band[0]] = False
+    grid[band[-1] + 1:] = False
+    gy, gx = np.nonzero(grid)
+    cx, cy = (gx.min() + gx.max()) / 2, (gy.min() + gy.max()) / 2
+    half = (gx.max() - gx.min()) / 2
+
+    by, bx = np.nonzero(near(rgb, app.hex_rgb("#2563eb")))
+    x, y = (bx - cx) / half, (by - cy) / half
+    inside = (np.abs(x) <= 1) & (np.abs(y) <= 1)
+    x, y = x[inside], y[inside]
+    bins = ((np.arctan2(x, -y) % (2 * np.pi)) / (2 * np.pi) * ANGLE_BINS).astype(int)
+    profile = np.zeros(ANGLE_BINS)
+    np.maximum.at(profile, bins, np.hypot(x, y))
+    return profile
+
+
+@pytest.fixture(scope="module")
+def profiles(app, pil_fonts):
+    pil = {pcts: radar_profile(app, app.generate_result_image_pil("Ming", "Lord", *pcts, pil_fonts))
+           for pcts in PCT_SETS}
+    mpl = {pcts: radar_profile(app, app.generate_result_image_mpl("Ming", "Lord", *pcts))
+           for pcts in PCT_SETS}
+    return pil, mpl
+
+
+@pytest.mark.parametrize("pcts", PCT_SETS)
+def test_engines_draw_the_same_radar(profiles, pcts):
+    pil, mpl = profiles
+    assert np.abs(pil[pcts] - mpl[pcts]).mean() < TOLERANCE
+
+
+def test_radar_comparison_tells_sets_apart(profiles):
+    # 確認容許誤差夠嚴格：不同分數的雷達圖不會被當成相同
+    pil, mpl = profiles
+    for a in PCT_SETS:
+        for b in PCT_SETS:
+            if a != b:
+                assert np.abs(pil[a] - mpl[b]).mean() > TOLERANCE
+
+
+def test_pillow_bugs_are_not_hidden(app, pil_fonts, monkeypatch):
+    def broken(*args):
+        raise ValueError("bug")
+    monkeypatch.setattr(app, "IMAGE_ENGINE", "pillow")
+    monkeypatch.setattr(app, "draw_radar_pil", broken)
+    with pytest.raises(ValueError):
+        app.generate_result_image("Ming", "Lord", 25, 25, 25, 25, pil_fonts, app.get_mpl_lock())
+
+
+def test_font_errors_fall_back_to_matplotlib(app, pil_fonts, monkeypatch):
+    def unreadable_font(*args):
+        raise OSError("cannot render glyph")
+    monkeypatch.setattr(app, "IMAGE_ENGINE", "pillow")
+    monkeypatch.setattr(app, "draw_radar_pil", unreadable_font)
+    png = app.generate_result_image("Ming", "Lord", 25, 25, 25, 25, pil_fonts, app.get_mpl_lock())
+    assert png.startswith(b"\x89PNG")
@@ -0,0 +1,47 @@
+import csv
+
+
+def log(app, path, name, answers):
+    responses = dict(enumerate(answers))
+    scores = app.calculate_scores(responses)
+    return app.log_results_to_csv(name, responses, scores, app.determine_profile(scores),
+                                  file_path=str(path), q_count=len(answers))
+
+
+def test_row_offsets_match_csv(app, tmp_path):
+    path = tmp_path / "results_log.csv"
+    offsets = [log(app, path, name, answers)
+               for name, answers in [("Ming", "DDBT"), ('多行\n"名字"', "SSTB"), ("ming", "BBBD")]]
+    data = path.read_bytes()
+    located = app.csv_rows_with_offsets(data, 0)
+    assert [pos for pos, _ in located[1:]] == offsets
+    assert [r for _, r in located] == list(csv.reader(data.decode("utf-8-sig").splitlines(keepends=True)))
+
+
+def test_retrieval_code_finds_its_own_row(app, tmp_path):
+    # 同一秒內、姓名只差大小寫的兩筆紀錄，各自的代碼只能取回自己的報告
+    path = tmp_path / "results_log.csv"
+    index = app.ResultsIndex(str(tmp_path / "results_index.db"))
+    for name, answers, code in [("Ming", "DDDB", "AAAAAAAA"), ("ming", "SSST", "BBBBBBBB")]:
+        row_offset = log(app, path, name, answers)
+        index.sync("t", str(path))
+        index.add_retrieval_code("t", code, row_offset)
+
+    ts, name, _, codes, mask = index.find_by_code("t", "bbbbbbbb")
+    assert (name, app.unpack_answers(codes, mask, 4)) == ("ming", "SSST")
+    ts, name, _, codes, mask = index.find_by_code("t", "AAAAAAAA")
+    assert (name, app.unpack_answers(codes, mask, 4)) == ("Ming", "DDDB")
+    assert index.find_by_code("t", "CCCCCCCC") is None
+
+
+def test_index_round_trips_two_word_answers(app, tmp_path):
+    path = tmp_path / "results_log.csv"
+    answers = ("DBTS" * 16)[:60] + "----"
+    log(app, path, "Ming", answers)
+    index = app.ResultsIndex(str(tmp_path / "results_index.db"))
+    index.sync("t", str(path))
+
+    (_, _, _, codes, mask), = index.search("t", name="ming")
+    assert app.unpack_answers(codes, mask, 64) == answers
+    members, packed = index.latest_per_person("t")
+    assert app.packed_scores(packed).tolist() == [[answers.count(e) for e in app.PACK_ENERGIES]]
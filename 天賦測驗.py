@@ -1,19 +1,39 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
 import matplotlib.pyplot as plt
 import matplotlib
 matplotlib.use('Agg')
 import numpy as np
 import matplotlib.font_manager as fm
 from fpdf import FPDF
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
 import base64
 import os
 import io
 import csv
 import platform
+import sys
 import glob
+import functools
+import hashlib
+import json
+import re
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+try:
+    import fcntl
+except ImportError:   # Windows 沒有 fcntl，改為不加跨行程鎖
+    fcntl = None
 
 # --- 跨平台中文字型偵測 ---
 def get_chinese_font():
@@ -35,13 +55,399 @@ def get_chinese_font():
 
 CN_FONT_NAME, CN_FONT_PATH = get_chinese_font()
 
+# --- 多租戶設定 ---
+# 每個租戶一個資料夾：tenants/<id>/config.json (品牌、題庫、角色文字) 與 results_log.csv
+TENANTS_DIR = os.environ.get("TD_TENANTS_DIR", "tenants")
+DEFAULT_TENANT = "default"
+TENANT_ID_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+TENANT_CACHE_SIZE = int(os.environ.get("TD_TENANT_CACHE_SIZE", "256"))
+RENDER_CACHE_SIZE = int(os.environ.get("TD_RENDER_CACHE_SIZE", "64"))
+
+def load_tenant_config(tenant_id):
+    """讀取單一租戶設定；預設租戶沿用根目錄的 results_log.csv"""
+    tenant = {
+        "id": tenant_id,
+        "results_path": "results_log.csv",
+        "branding": {},
+        "questions": None,
+        "profile_details": None,
+        "version": "",
+        "adaptive": False,
+        "config_error": None,
+        "render_cache": OrderedDict(),
+        "render_lock": threading.Lock(),
+    }
+    if tenant_id == DEFAULT_TENANT:
+        return tenant
+
+    tenant_dir = os.path.join(TENANTS_DIR, tenant_id)
+    tenant["results_path"] = os.path.join(tenant_dir, "results_log.csv")
+    config_path = os.path.join(tenant_dir, "config.json")
+    if os.path.isfile(config_path):
+        tenant["version"] = str(os.path.getmtime(config_path))
+        with open(config_path, encoding="utf-8") as f:
+            cfg = json.load(f)
+        tenant["branding"] = cfg.get("branding", {})
+        tenant["questions"] = cfg.get("questions")
+        if tenant["questions"] and len(tenant["questions"]) > PACKED_MAX_QUESTIONS:
+            # 結果索引放不下這麼多題；不改用其他題庫，頁面直接顯示設定錯誤
+            tenant["config_error"] = f"題庫有 {len(tenant['questions'])} 題，最多支援 {PACKED_MAX_QUESTIONS} 題"
+        tenant["profile_details"] = cfg.get("profile_details")
+        tenant["adaptive"] = cfg.get("adaptive", False)
+    return tenant
+
+class TenantRegistry:
+    """租戶設定的 LRU 快取：首次存取才載入，超過上限時淘汰最久未使用的租戶"""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id):
+        with self._lock:
+            if tenant_id in self._tenants:
+                self._tenants.move_to_end(tenant_id)
+                return self._tenants[tenant_id]
+        tenant = load_tenant_config(tenant_id)
+        with self._lock:
+            # 併發載入時以先放入者為準
+            tenant = self._tenants.setdefault(tenant_id, tenant)
+            self._tenants.move_to_end(tenant_id)
+            while len(self._tenants) > self.max_size:
+                self._tenants.popitem(last=False)
+        return tenant
+
+@st.cache_resource
+def get_tenant_registry():
+    return TenantRegistry(TENANT_CACHE_SIZE)
+
+def resolve_tenant_id():
+    """依網址參數 ?tenant= 或子網域判斷租戶，未知租戶一律回到預設"""
+    tenant_id = st.query_params.get("tenant", "")
+    if not tenant_id and hasattr(st, "context"):
+        host = st.context.headers.get("Host", "").split(":")[0]
+        parts = host.split(".")
+        if len(parts) > 2:
+            tenant_id = parts[0]
+    tenant_id = tenant_id.lower()
+    if TENANT_ID_RE.match(tenant_id) and os.path.isdir(os.path.join(TENANTS_DIR, tenant_id)):
+        return tenant_id
+    return DEFAULT_TENANT
+
+# --- 主機共用的圖檔/PDF 快取 ---
+# 同一台主機上的多個 Streamlit 行程共用一個以內容雜湊命名的資料夾，報告只需繪製一次
+ARTIFACT_CACHE_DIR = os.environ.get("TD_ARTIFACT_CACHE_DIR", ".artifact_cache")
+ARTIFACT_CACHE_BYTES = int(os.environ.get("TD_ARTIFACT_CACHE_MB", "512")) * 1024 * 1024
+ARTIFACT_PRUNE_EVERY = 64   # 每寫入幾個檔案檢查一次容量
+# PNG/PDF 的版面或內容有任何變動時遞增，讓各主機上舊版的快取檔自然失效
+RENDER_VERSION = 2
+
+class SharedArtifactCache:
+    """以 sha256 為檔名的磁碟快取：原子寫入、依 mtime 淘汰、跨行程以檔案鎖避免重複繪製"""
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get(self, digest):
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)   # 更新 mtime 作為最近使用時間
+        except OSError:
+            pass
+        return data
+
+    def put(self, digest, data):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % ARTIFACT_PRUNE_EVERY == 0
+        if should_prune:
+            self.prune()
+
+    @contextmanager
+    def _render_lock(self, digest):
+        """同一分片共用一個鎖檔，鎖檔數量固定為 256 個"""
+        if fcntl is None:
+            yield
+            return
+        lock_dir = os.path.join(self.root, digest[:2])
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_or_render(self, digest, render_fn):
+        data = self.get(digest)
+        if data is not None:
+            return data
+        with self._render_lock(digest):
+            # 等鎖期間其他行程可能已經畫好了
+            data = self.get(digest)
+            if data is None:
+                data = render_fn()
+                self.put(digest, data)
+        return data
+
+    def prune(self):
+        """總容量超過上限時，從最久未使用的檔案開始刪到 90%"""
+        entries = []
+        total = 0
+        for shard in glob.glob(os.path.join(self.root, "??")):
+            # 其他行程可能同時在淘汰或 os.replace，掃描期間消失的檔案/分片直接略過
+            try:
+                with os.scandir(shard) as it:
+                    for entry in it:
+                        if entry.name.startswith("."):
+                            continue
+                        try:
+                            st_info = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((st_info.st_mtime, st_info.st_size, entry.path))
+                        total += st_info.st_size
+            except FileNotFoundError:
+                continue
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self.max_bytes * 0.9:
+                break
+
+@st.cache_resource
+def get_artifact_cache():
+    return SharedArtifactCache(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_BYTES)
+
+def artifact_digest(tenant, key):
+    """快取鍵含繪圖版本、租戶設定版本與繪圖引擎，程式或設定改動後自然失效"""
+    payload = json.dumps([RENDER_VERSION, tenant["id"], tenant["version"], IMAGE_ENGINE, key], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def tenant_render_cached(tenant, key, render_fn, artifact_cache):
+    """租戶專屬的圖檔/PDF 快取 (LRU)，未命中時再查主機共用快取"""
+    cache = tenant["render_cache"]
+    with tenant["render_lock"]:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    data = artifact_cache.get_or_render(artifact_digest(tenant, key), render_fn)
+    with tenant["render_lock"]:
+        cache[key] = data
+        while len(cache) > RENDER_CACHE_SIZE:
+            cache.popitem(last=False)
+    return data
+
+# --- 背景繪製服務 ---
+# 結果頁先送出 PNG/PDF 工作就繼續畫卡片與圖表，下載按鈕等工作完成後才出現
+RENDER_WORKERS = int(os.environ.get("TD_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_JOB_HISTORY = 256
+# 尚未開始的繪製工作超過此數量時，新工作直接拒絕 (load shedding)
+RENDER_QUEUE_LIMIT = int(os.environ.get("TD_RENDER_QUEUE_LIMIT", "200"))
+
+class RenderRejected(Exception):
+    """繪製佇列已滿"""
+
+class RenderService:
+    """背景繪製的執行緒池；相同的工作在多次 rerun 之間共用同一個 future"""
+    def __init__(self, workers):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="td-render")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._submitted_seq = 0
+        self._started_seq = 0
+        # 進行中的作答頁 rerun 數與正在繪製的工作數，共用 _lock
+        self._interactive = 0
+        self._active = 0
+        self._idle = threading.Condition(self._lock)
+
+    @contextmanager
+    def interactive(self):
+        """包住作答頁的 rerun；期間背景繪製最多只留一份工作在跑"""
+        with self._idle:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._interactive -= 1
+                self._idle.notify_all()
+
+    def _run(self, seq, tenant, key, render_fn, artifact_cache):
+        with self._idle:
+            self._idle.wait_for(lambda: self._interactive == 0 or self._active == 0)
+            self._active += 1
+            self._started_seq = max(self._started_seq, seq)
+        try:
+            return tenant_render_cached(tenant, key, render_fn, artifact_cache)
+        finally:
+            with self._idle:
+                self._active -= 1
+                self._idle.notify_all()
+
+    def submit(self, tenant, key, render_fn):
+        job_key = (tenant["id"], key)
+        with self._lock:
+            job = self._jobs.get(job_key)
+            # 失敗的工作下次送出時重試
+            if job is not None and not (job.done() and job.exception()):
+                self._jobs.move_to_end(job_key)
+                return job
+            job = Future()
+            cached = tenant["render_cache"].get(key)
+            if cached is not None:
+                # 已在記憶體快取中，不必排隊
+                job.set_result(cached)
+                return job
+            if self._submitted_seq - self._started_seq >= RENDER_QUEUE_LIMIT:
+                job.set_exception(RenderRejected())
+                return job
+            self._submitted_seq += 1
+            job = self._pool.submit(self._run, self._submitted_seq, tenant, key, render_fn, get_artifact_cache())
+            job.td_seq = self._submitted_seq
+            self._jobs[job_key] = job
+            while len(self._jobs) > RENDER_JOB_HISTORY:
+                self._jobs.popitem(last=False)
+        return job
+
+    def queue_position(self, job):
+        """前面還有幾份尚未開始的工作"""
+        return max(0, getattr(job, "td_seq", 0) - self._started_seq - 1)
+
+@st.cache_resource
+def get_render_service():
+    return RenderService(RENDER_WORKERS)
+
+def artifact_download_button(job, label, file_name, mime):
+    """工作完成前顯示停用的按鈕並輪詢，完成後換成下載按鈕"""
+    polling = not job.done()
+
+    @st.fragment(run_every=0.5 if polling else None)
+    def _button():
+        if not job.done():
+            position = get_render_service().queue_position(job)
+            status = f"排隊中，前面還有 {position} 份" if position else "產生中…"
+            st.button(f"{label} ({status})", disabled=True, key=f"pending_{file_name}")
+        elif isinstance(job.exception(), RenderRejected):
+            st.warning("目前使用人數眾多，檔案稍後才能產生。")
+            if st.button(f"{label} (重新嘗試)", key=f"retry_{file_name}"):
+                st.rerun(scope="app")
+        elif job.exception() is not None:
+            st.error("檔案產生失敗，請重新整理頁面再試一次。")
+        elif polling:
+            # 整頁重跑一次，讓按鈕停止輪詢
+            st.rerun(scope="app")
+        else:
+            st.download_button(label=label, data=job.result(), file_name=file_name,
+                               mime=mime, type="primary")
+    _button()
+
+# --- 作答進度檢查點 (跨 replica 續測) ---
+# 進度以網址參數 ?sid= 的代號存進共用的 SQLite，任何一台 replica 都能接手
+CHECKPOINT_DB = os.environ.get("TD_CHECKPOINT_DB", "session_checkpoints.db")
+CHECKPOINT_TTL = 7 * 24 * 3600   # 超過 7 天未更新的進度會被清除
+CHECKPOINT_PURGE_EVERY = 256     # 每寫入幾次清除一次過期進度
+SESSION_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+def encode_answers(responses, q_count):
+    """將作答字典壓成字串，例如 'DBTS-...'，未作答為 '-'"""
+    return "".join(responses.get(i, "-") for i in range(q_count))
+
+def decode_answers(answers):
+    return {i: a for i, a in enumerate(answers) if a != "-"}
+
+class CheckpointStore:
+    """以 SQLite (WAL) 保存每個受測者的作答進度"""
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                tenant TEXT, token TEXT, uname TEXT, step INTEGER,
+                answers TEXT, logged INTEGER, updated REAL,
+                PRIMARY KEY (tenant, token))""")
+        # report：結果頁產生的資料 (查詢代碼等)，JSON 字串
+        if "report" not in [r[1] for r in self._conn.execute("PRAGMA table_info(checkpoints)")]:
+            self._conn.execute("ALTER TABLE checkpoints ADD COLUMN report TEXT DEFAULT ''")
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._purge()
+
+    def _purge(self):
+        self._conn.execute("DELETE FROM checkpoints WHERE updated < ?", (time.time() - CHECKPOINT_TTL,))
+
+    def load(self, tenant_id, token):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT uname, step, answers, logged, report FROM checkpoints WHERE tenant = ? AND token = ?",
+                (tenant_id, token)).fetchone()
+        return tuple(row) if row else None
+
+    def save(self, tenant_id, token, snapshot):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (tenant, token, uname, step, answers, logged, report, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (tenant_id, token) + snapshot + (time.time(),))
+            # 長時間執行的 replica 也要定期清掉過期進度
+            self._writes += 1
+            if self._writes % CHECKPOINT_PURGE_EVERY == 0:
+                self._purge()
+
+    def delete(self, tenant_id, token):
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE tenant = ? AND token = ?", (tenant_id, token))
+
+@st.cache_resource
+def get_checkpoint_store():
+    return CheckpointStore(CHECKPOINT_DB)
+
+def checkpoint_session(q_count):
+    """進度有變動才寫入，同一次 rerun 內的多次修改只會寫一次
+
+    尚未輸入姓名的 session (單純開啟頁面、爬蟲、健康檢查) 不寫入。
+    """
+    if not st.session_state.uname:
+        return
+    snapshot = (st.session_state.uname, st.session_state.step,
+                encode_answers(st.session_state.responses, q_count),
+                int("logged" in st.session_state),
+                json.dumps(st.session_state.get("report_meta", {}), ensure_ascii=False, sort_keys=True))
+    if snapshot != st.session_state.get("ckpt_last"):
+        get_checkpoint_store().save(TENANT["id"], st.session_state.ckpt_token, snapshot)
+        st.session_state.ckpt_last = snapshot
+
 # --- 數據紀錄功能 ---
-def log_results_to_csv(name, responses, scores, final_profile):
-    file_path = "results_log.csv"
+def log_results_to_csv(name, responses, scores, final_profile, file_path="results_log.csv", q_count=25):
+    file_dir = os.path.dirname(file_path)
+    if file_dir:
+        os.makedirs(file_dir, exist_ok=True)
     file_exists = os.path.isfile(file_path)
     
     # 準備題目的標頭 (Q1, Q2, ..., Q25)
-    q_headers = [f"Q{i+1}" for i in range(25)]
+    q_headers = [f"Q{i+1}" for i in range(q_count)]
     header = ["Timestamp", "Name"] + q_headers + ["Dynamo%", "Blaze%", "Tempo%", "Steel%", "FinalProfile"]
     
     # 計算百分比
@@ -53,21 +459,534 @@ def log_results_to_csv(name, responses, scores, final_profile):
     
     # 準備紀錄行
     # responses 是一個字典 {step_index: 'D/B/T/S'}
-    ans_row = [responses.get(i, "") for i in range(25)]
+    ans_row = [responses.get(i, "") for i in range(q_count)]
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     row = [timestamp, name] + ans_row + [d_pct, b_pct, t_pct, s_pct, final_profile]
     
-    with open(file_path, "a", newline="", encoding="utf-8-sig") as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(header)
-        writer.writerow(row)
+    def encode_row(values, encoding="utf-8"):
+        buf = io.StringIO()
+        csv.writer(buf).writerow(values)
+        return buf.getvalue().encode(encoding)
+
+    row_bytes = encode_row(row)
+    data = row_bytes if file_exists else encode_row(header, "utf-8-sig") + row_bytes
+    # 整段一次寫入 (append 模式)；寫完後的位置減去本列長度，就是這筆紀錄在 CSV 中的起始位元組，
+    # 可唯一識別這筆紀錄 (同一秒、同名的受測者也不會混淆)
+    with open(file_path, "ab") as f:
+        f.write(data)
+        f.flush()
+        return f.tell() - len(row_bytes)
+
+# --- 答案位元壓縮 ---
+# 每題 2 位元 (D=0, B=1, T=2, S=3)，每 32 題放進一個 uint64 (共 PACKED_WORDS 個)；
+# 另以 1 位元/題的遮罩標記有作答的題目。單筆答案 (pack_answers) 以 Python 整數表示，不受字數限制
+PACK_ENERGIES = "DBTS"
+ENERGY_NAMES = {"D": "發電機", "B": "火焰", "T": "節奏", "S": "鋼鐵"}
+PACKED_WORDS = 2
+PACKED_WORD_QUESTIONS = 32
+PACKED_MAX_QUESTIONS = PACKED_WORDS * PACKED_WORD_QUESTIONS
+PACKED_DTYPE = np.dtype([("codes", "<u8", (PACKED_WORDS,)), ("mask", "<u8")])
+_EVEN_BITS = np.uint64(0x5555555555555555)
+_PACK_LUT = np.full(256, 255, dtype=np.uint8)   # ASCII -> 2 位元代碼，255 表示未作答
+for _code, _energy in enumerate(PACK_ENERGIES):
+    _PACK_LUT[ord(_energy)] = _code
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def pack_answers(answers):
+    """'DBTS-...' 字串 -> (codes, mask)"""
+    if len(answers) > PACKED_MAX_QUESTIONS:
+        raise ValueError(f"答案壓縮最多支援 {PACKED_MAX_QUESTIONS} 題")
+    codes = mask = 0
+    for i, a in enumerate(answers):
+        code = PACK_ENERGIES.find(a)
+        if code >= 0:
+            codes |= code << (2 * i)
+            mask |= 1 << i
+    return codes, mask
+
+def unpack_answers(codes, mask, q_count):
+    """(codes, mask) -> 'DBTS-...' 字串"""
+    return "".join(PACK_ENERGIES[(codes >> (2 * i)) & 3] if (mask >> i) & 1 else "-"
+                   for i in range(q_count))
+
+def pack_answer_array(answer_strings, q_count):
+    """大量答案字串一次轉成 PACKED_DTYPE 陣列 (不足 q_count 題的視為未作答)"""
+    if q_count > PACKED_MAX_QUESTIONS:
+        raise ValueError(f"答案壓縮最多支援 {PACKED_MAX_QUESTIONS} 題")
+    packed = np.zeros(len(answer_strings), PACKED_DTYPE)
+    if q_count == 0 or not len(answer_strings):
+        return packed
+    raw = "".join(a.ljust(q_count, "-")[:q_count] for a in answer_strings).encode("ascii", "replace")
+    codes = _PACK_LUT[np.frombuffer(raw, np.uint8).reshape(-1, q_count)]
+    answered = codes != 255
+    slots = np.arange(q_count, dtype=np.uint64)
+    shifted = np.where(answered, codes, 0).astype(np.uint64) << (slots % PACKED_WORD_QUESTIONS * np.uint64(2))
+    for w in range(0, q_count, PACKED_WORD_QUESTIONS):
+        packed["codes"][:, w // PACKED_WORD_QUESTIONS] = np.bitwise_or.reduce(
+            shifted[:, w:w + PACKED_WORD_QUESTIONS], axis=1)
+    packed["mask"] = np.bitwise_or.reduce(answered.astype(np.uint64) << slots, axis=1)
+    return packed
+
+def join_packed_words(words):
+    """各 64 位元字組 (可為 SQLite 的有號整數) -> pack_answers 格式的 codes 整數"""
+    return sum((w & 0xFFFFFFFFFFFFFFFF) << (64 * i) for i, w in enumerate(words))
+
+def popcount(x):
+    if hasattr(np, "bitwise_count"):   # NumPy 2.0+
+        return np.bitwise_count(x)
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _BYTE_POPCOUNT[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+def spread_mask(mask):
+    """把每題 1 位元的遮罩展開到 2 位元欄位的低位 (第 i 位 -> 第 2i 位)"""
+    x = mask.astype(np.uint64)
+    for shift, bits in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        x = (x | (x << np.uint64(shift))) & np.uint64(bits)
+    return x
+
+def packed_scores(packed):
+    """直接在壓縮陣列上以位元運算與 popcount 計票，回傳 (n, 4) 的 D/B/T/S 票數"""
+    scores = np.zeros((len(packed), len(PACK_ENERGIES)), np.int64)
+    for w in range(PACKED_WORDS):
+        codes = packed["codes"][:, w]
+        lo = codes & _EVEN_BITS
+        hi = (codes >> np.uint64(1)) & _EVEN_BITS
+        # 未作答的欄位代碼為 0b00，與 D 相同，因此 D 需要再與遮罩相交
+        answered = spread_mask((packed["mask"] >> np.uint64(PACKED_WORD_QUESTIONS * w)) & np.uint64(0xFFFFFFFF))
+        counts = [answered & ~hi & ~lo, lo & ~hi, hi & ~lo, hi & lo]
+        scores += np.stack([popcount(c) for c in counts], axis=1)
+    return scores
+
+# --- 結果索引 (查詢過去的報告) ---
+# results_log.csv 仍是正本；索引從上次讀到的位置往後補，多個行程同時寫入也不會重複
+RESULTS_INDEX_DB = os.environ.get("TD_RESULTS_INDEX_DB", "results_index.db")
+INDEX_SYNC_CHUNK = 8 * 1024 * 1024
+
+def csv_rows_with_offsets(data, base):
+    """解析 CSV 的 bytes，回傳 [(列起始位元組位置, 欄位)]；base 為 data 在檔案中的位置
+
+    csv.reader 每次只取完成一列所需的行，因此可依已讀取的位元組數算出每列的起點。
+    """
+    consumed = base
+
+    def lines():
+        nonlocal consumed
+        for line in data.splitlines(keepends=True):
+            consumed += len(line)
+            yield line.decode("utf-8-sig")
+
+    located, start = [], base
+    for row in csv.reader(lines()):
+        located.append((start, row))
+        start = consumed
+    return located
+
+class ResultsIndex:
+    """以 SQLite 為 results_log.csv 建立姓名、時間與角色的索引
+
+    答案以 PACKED_DTYPE 的字組存成 codes、codes_hi 與 mask (皆以有號 64 位元保存)。
+    另外維護各能量百分比的人數分佈 (全體與各角色)，補索引時每筆紀錄只需更新固定數量的格子。
+    """
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        tables = {r[0] for r in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        columns = [r[1] for r in self._conn.execute("PRAGMA table_info(results)")]
+        if "results" in tables and "codes_hi" not in columns:
+            # 舊版索引 (沒有每列的 CSV 位置或只有一個答案字組)；索引可由 CSV 重建，直接清掉重新補
+            self._conn.executescript("""
+                DROP TABLE IF EXISTS results; DROP TABLE IF EXISTS index_state;
+                DROP TABLE IF EXISTS histograms; DROP TABLE IF EXISTS retrieval_codes;""")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                tenant TEXT, row_offset INTEGER, ts TEXT, name TEXT, name_key TEXT, profile TEXT,
+                codes INTEGER, codes_hi INTEGER, mask INTEGER, PRIMARY KEY (tenant, row_offset));
+            CREATE INDEX IF NOT EXISTS idx_results_name ON results (tenant, name_key, ts);
+            CREATE INDEX IF NOT EXISTS idx_results_ts ON results (tenant, ts);
+            CREATE INDEX IF NOT EXISTS idx_results_profile ON results (tenant, profile, ts);
+            CREATE TABLE IF NOT EXISTS index_state (tenant TEXT PRIMARY KEY, csv_offset INTEGER);
+            CREATE TABLE IF NOT EXISTS retrieval_codes (
+                tenant TEXT, code TEXT, row_offset INTEGER, PRIMARY KEY (tenant, code));
+            CREATE TABLE IF NOT EXISTS histograms (
+                tenant TEXT, scope TEXT, energy TEXT, pct INTEGER, count INTEGER,
+                PRIMARY KEY (tenant, scope, energy, pct));
+        """)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def name_key(name):
+        return name.strip().casefold()
+
+    def sync(self, tenant_id, csv_path):
+        """把 CSV 新增的列補進索引 (只讀取上次位置之後的內容)"""
+        if not os.path.isfile(csv_path):
+            return
+        size = os.path.getsize(csv_path)
+        with self._lock:
+            # BEGIN IMMEDIATE 讓多個行程依序補索引
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT csv_offset FROM index_state WHERE tenant = ?", (tenant_id,)).fetchone()
+                offset = row[0] if row else 0
+                if size < offset:
+                    # CSV 被換掉或截斷，整份重建
+                    self._conn.execute("DELETE FROM results WHERE tenant = ?", (tenant_id,))
+                    self._conn.execute("DELETE FROM histograms WHERE tenant = ?", (tenant_id,))
+                    # 查詢代碼以 CSV 位置對應紀錄，換過的 CSV 位置已不可信
+                    self._conn.execute("DELETE FROM retrieval_codes WHERE tenant = ?", (tenant_id,))
+                    offset = 0
+                with open(csv_path, "rb") as f:
+                    f.seek(offset)
+                    while offset < size:
+                        chunk = f.read(min(INDEX_SYNC_CHUNK, size - offset))
+                        end = chunk.rfind(b"\n") + 1
+                        if end == 0:
+                            break   # 最後一列還沒寫完
+                        located = csv_rows_with_offsets(chunk[:end], offset)
+                        if offset == 0:
+                            located = located[1:]   # 標頭
+                        located = [(pos, r) for pos, r in located if len(r) > 7]
+                        rows = [r for _, r in located]
+                        packed = pack_answer_array(["".join(a or "-" for a in r[2:-5]) for r in rows],
+                                                   max((len(r) - 7 for r in rows), default=0))
+                        self._conn.executemany(
+                            "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(tenant_id, pos, r[0], r[1], self.name_key(r[1]), r[-1], codes, codes_hi, mask)
+                             for (pos, r), (codes, codes_hi), mask in zip(
+                                 located, packed["codes"].view(np.int64).tolist(),
+                                 packed["mask"].view(np.int64).tolist())])
+                        self._add_to_histograms(tenant_id, rows)
+                        offset += end
+                        f.seek(offset)
+                self._conn.execute("INSERT OR REPLACE INTO index_state VALUES (?, ?)", (tenant_id, offset))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _add_to_histograms(self, tenant_id, rows):
+        # scope "" 為全體，其餘為角色名稱
+        bins = Counter()
+        for r in rows:
+            try:
+                pcts = [int(v) for v in r[-5:-1]]
+            except ValueError:
+                continue
+            for energy, pct in zip(PACK_ENERGIES, pcts):
+                bins[("", energy, pct)] += 1
+                bins[(r[-1], energy, pct)] += 1
+        self._conn.executemany(
+            "INSERT INTO histograms VALUES (?, ?, ?, ?, ?) ON CONFLICT (tenant, scope, energy, pct) "
+            "DO UPDATE SET count = count + excluded.count",
+            [(tenant_id, scope, energy, pct, n) for (scope, energy, pct), n in bins.items()])
+
+    def percentile_ranks(self, tenant_id, pcts, profile=None):
+        """pcts 為 {'D': 28, ...}；回傳各能量「低於此百分比的人數」佔全體 (或同角色) 的百分比
+
+        每個能量最多只讀 101 個分佈格子，與紀錄筆數無關；沒有資料時為 None。
+        """
+        ranks = {}
+        with self._lock:
+            for energy, pct in pcts.items():
+                total, below = self._conn.execute(
+                    "SELECT SUM(count), SUM(CASE WHEN pct < ? THEN count ELSE 0 END) FROM histograms "
+                    "WHERE tenant = ? AND scope = ? AND energy = ?",
+                    (pct, tenant_id, profile or "", energy)).fetchone()
+                ranks[energy] = round(below * 100 / total) if total else None
+        return ranks
+
+    def add_retrieval_code(self, tenant_id, code, row_offset):
+        """row_offset 為 log_results_to_csv 回傳的紀錄起始位置"""
+        with self._lock:
+            self._conn.execute("INSERT INTO retrieval_codes VALUES (?, ?, ?)", (tenant_id, code, row_offset))
+
+    def find_by_code(self, tenant_id, code):
+        """依查詢代碼取回單筆紀錄 (格式同 search)，找不到時回傳 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT r.ts, r.name, r.profile, r.codes, r.codes_hi, r.mask FROM retrieval_codes c "
+                "JOIN results r ON r.tenant = c.tenant AND r.row_offset = c.row_offset "
+                "WHERE c.tenant = ? AND c.code = ?",
+                (tenant_id, code.strip().upper())).fetchone()
+        if row is None:
+            return None
+        ts, name, profile, codes, codes_hi, mask = row
+        return ts, name, profile, join_packed_words((codes, codes_hi)), mask & 0xFFFFFFFFFFFFFFFF
+
+    def search(self, tenant_id, name=None, start=None, end=None, profile=None, limit=50):
+        """依姓名、時間範圍 (含頭尾，格式同 CSV 的 Timestamp) 與角色查詢，新到舊排序
+
+        回傳 (ts, name, profile, codes, mask)，codes 與 mask 已轉回 pack_answers 的無號整數。
+        """
+        sql = "SELECT ts, name, profile, codes, codes_hi, mask FROM results WHERE tenant = ?"
+        params = [tenant_id]
+        if name:
+            sql += " AND name_key = ?"
+            params.append(self.name_key(name))
+        if start:
+            sql += " AND ts >= ?"
+            params.append(start)
+        if end:
+            sql += " AND ts <= ?"
+            params.append(end)
+        if profile:
+            sql += " AND profile = ?"
+            params.append(profile)
+        sql += " ORDER BY ts DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [(ts, name, profile, join_packed_words((codes, codes_hi)), mask & 0xFFFFFFFFFFFFFFFF)
+                for ts, name, profile, codes, codes_hi, mask in rows]
+
+    def latest_per_person(self, tenant_id, names=None, start=None, end=None):
+        """每人只取範圍內最新的一筆；names 為空時取範圍內所有人
+
+        回傳 ([(name, profile), ...], PACKED_DTYPE 陣列)。
+        """
+        sql = "SELECT name, profile, codes, codes_hi, mask, MAX(ts) FROM results WHERE tenant = ?"
+        params = [tenant_id]
+        if start:
+            sql += " AND ts >= ?"
+            params.append(start)
+        if end:
+            sql += " AND ts <= ?"
+            params.append(end)
+        keys = sorted({self.name_key(n) for n in names or [] if n.strip()})
+        rows = []
+        with self._lock:
+            if not keys:
+                rows = self._conn.execute(sql + " GROUP BY name_key", params).fetchall()
+            # 名單很長時分批，避免超過 SQLite 的參數上限
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows += self._conn.execute(
+                    sql + f" AND name_key IN ({','.join('?' * len(batch))}) GROUP BY name_key",
+                    params + batch).fetchall()
+        packed = np.zeros(len(rows), PACKED_DTYPE)
+        packed["codes"] = np.array([r[2:4] for r in rows], dtype=np.int64).reshape(-1, PACKED_WORDS).view(np.uint64)
+        packed["mask"] = np.array([r[4] for r in rows], dtype=np.int64).view(np.uint64)
+        return [r[:2] for r in rows], packed
+
+@st.cache_resource
+def get_results_index():
+    return ResultsIndex(RESULTS_INDEX_DB)
+
+# 查詢代碼：只有受測者本人拿得到，憑代碼取回自己的報告 (不含易混淆的 0/O、1/I)
+RETRIEVAL_CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+RETRIEVAL_CODE_LENGTH = 8
+
+def new_retrieval_code():
+    return "".join(secrets.choice(RETRIEVAL_CODE_ALPHABET) for _ in range(RETRIEVAL_CODE_LENGTH))
+
+def describe_percentiles(pcts, ranks, profile_short):
+    """例如「節奏 20%：高於 83% 的受測者、高於 70% 的商人」；尚無資料的能量略過"""
+    lines = []
+    for energy, name in ENERGY_NAMES.items():
+        parts = []
+        if ranks["all"][energy] is not None:
+            parts.append(f"高於 {ranks['all'][energy]}% 的受測者")
+        if ranks["profile"][energy] is not None:
+            parts.append(f"高於 {ranks['profile'][energy]}% 的{profile_short}")
+        if parts:
+            lines.append(f"{name} {pcts[energy]}%：{'、'.join(parts)}")
+    return lines
+
+# --- 雷達圖規格 ---
+# 八角色雷達圖只描述一次：網頁輸出成 SVG，PNG (Pillow/matplotlib) 與 PDF 依同一份圖元繪製
+# 座標以圓心為原點、y 向下，單位為 PNG 上的像素 (dpi=150)；字級為點數
+RADAR_RADIUS = 546
+RADAR_EXTENT = 680     # 含外圍標籤的繪圖範圍為 ±RADAR_EXTENT
+RADAR_BG = '#0f172a'
+RADAR_LABELS = ['創作者', '明星', '支持者', '媒合者', '商人', '積蓄者', '地主', '技師']
+RADAR_FONT_FAMILY = '"Microsoft JhengHei", "Noto Sans TC", "Noto Sans CJK TC", sans-serif'
+
+@functools.lru_cache(maxsize=1024)
+def radar_chart_spec(d_pct, b_pct, t_pct, s_pct):
+    """回傳雷達圖的圖元 tuple，每個圖元為以下其中一種：
+
+    ("polygon", 點列, 填色, 透明度, 線色, 線寬)、("line", 起點, 終點, 線色, 線寬, 虛線長度)、
+    ("circle", 圓心, 半徑, 顏色)、("text", 中心點, 文字, 字級, 顏色, 粗體)
+    """
+    r_data = [
+        d_pct, (d_pct + b_pct)/2, b_pct, (b_pct + t_pct)/2,
+        t_pct, (t_pct + s_pct)/2, s_pct, (s_pct + d_pct)/2
+    ]
+    max_v = max(r_data) * 1.2 if max(r_data) > 0 else 10
+    scale = RADAR_RADIUS / max_v
+    angles = np.linspace(0, 2 * np.pi, 8, endpoint=False)
+
+    # 0 度在上方、順時針
+    def xy(a, r):
+        return round(float(r * scale * np.sin(a)), 2), round(float(-r * scale * np.cos(a)), 2)
+
+    items = []
+    # 網格與放射線 (虛線)
+    for lvl in [0.2, 0.4, 0.6, 0.8, 1.0]:
+        items.append(("polygon", tuple(xy(a, max_v * lvl) for a in angles), None, 0, '#94a3b8', 2))
+    for a in angles:
+        items.append(("line", (0.0, 0.0), xy(a, max_v), '#94a3b8', 2, RADAR_RADIUS / 40))
+
+    # 數據
+    data_pts = tuple(xy(a, r) for a, r in zip(angles, r_data))
+    items.append(("polygon", data_pts, '#2563eb', 0.15, '#2563eb', 5))
+    items += [("circle", pt, 8, '#fbbf24') for pt in data_pts]
+
+    # 外圍黃色圓點與角色標籤
+    for a, label in zip(angles, RADAR_LABELS):
+        items.append(("circle", xy(a, max_v * 1.02), 7, '#fbbf24'))
+        items.append(("text", xy(a, max_v * 1.15), label, 12, '#e2e8f0', True))
+
+    # 四大能量標籤與內傾/外傾
+    for a, label, color in [(0, '發電機', '#fbbf24'), (np.pi/2, '火焰', '#f87171'),
+                            (np.pi, '節奏', '#a78bfa'), (3*np.pi/2, '鋼鐵', '#60a5fa')]:
+        items.append(("text", xy(a, max_v * 0.55), label, 11, color, True))
+    items.append(("text", xy(np.pi * 1.25, max_v * 0.35), '內傾', 10, '#94a3b8', False))
+    items.append(("text", xy(np.pi * 0.75, max_v * 0.35), '外傾', 10, '#94a3b8', False))
+    return tuple(items)
+
+def hex_rgb(color):
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+
+def radar_svg(spec):
+    """網頁用：輸出成寬度自適應的 SVG"""
+    e = RADAR_EXTENT
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="{-e} {-e} {2 * e} {2 * e}" '
+           f'style="display:block; width:100%; max-width:560px; margin:auto;" font-family=\'{RADAR_FONT_FAMILY}\'>']
+    for kind, *args in spec:
+        if kind == "polygon":
+            pts, fill, alpha, stroke, width = args
+            points = " ".join(f"{x},{y}" for x, y in pts)
+            out.append(f'<polygon points="{points}" fill="{fill or "none"}" fill-opacity="{alpha}" '
+                       f'stroke="{stroke}" stroke-width="{width}" stroke-linejoin="round"/>')
+        elif kind == "line":
+            (x1, y1), (x2, y2), color, width, dash = args
+            out.append(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" stroke="{color}" '
+                       f'stroke-width="{width}" stroke-dasharray="{dash}"/>')
+        elif kind == "circle":
+            (x, y), r, color = args
+            out.append(f'<circle cx="{x}" cy="{y}" r="{r}" fill="{color}"/>')
+        else:
+            (x, y), txt, size, color, bold = args
+            weight = "bold" if bold else "normal"
+            out.append(f'<text x="{x}" y="{y}" font-size="{size * PIL_DPI_SCALE:.1f}" font-weight="{weight}" '
+                       f'fill="{color}" text-anchor="middle" dominant-baseline="central">{txt}</text>')
+    out.append('</svg>')
+    return "".join(out)
+
+def draw_radar_pil(img, spec, center, fonts):
+    """PNG 用：以 Pillow 畫在 img 上，center 為圓心的像素座標"""
+    draw = ImageDraw.Draw(img)
+    cx, cy = center
+
+    def at(p):
+        return cx + p[0], cy + p[1]
+
+    for kind, *args in spec:
+        if kind == "polygon":
+            pts, fill, alpha, stroke, width = args
+            pts = [at(p) for p in pts]
+            if fill:
+                # 半透明填色只在多邊形外框範圍內合成
+                xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+                box = (int(min(xs)), int(min(ys)), int(max(xs)) + 2, int(max(ys)) + 2)
+                mask = Image.new('L', (box[2] - box[0], box[3] - box[1]), 0)
+                ImageDraw.Draw(mask).polygon([(x - box[0], y - box[1]) for x, y in pts], fill=round(alpha * 255))
+                img.paste(fill, box, mask)
+            draw.line(pts + pts[:1], fill=stroke, width=width, joint='curve')
+        elif kind == "line":
+            (x1, y1), (x2, y2), color, width, dash = args
+            n = max(1, round(np.hypot(x2 - x1, y2 - y1) / dash))
+            for seg in range(0, n, 2):
+                t0, t1 = seg / n, (seg + 1) / n
+                draw.line([at((x1 + (x2 - x1) * t0, y1 + (y2 - y1) * t0)),
+                           at((x1 + (x2 - x1) * t1, y1 + (y2 - y1) * t1))], fill=color, width=width)
+        elif kind == "circle":
+            p, r, color = args
+            x, y = at(p)
+            draw.ellipse([x - r, y - r, x + r, y + r], fill=color)
+        else:
+            p, txt, size, color, bold = args
+            draw.text(at(p), txt, font=fonts[size], fill=color, anchor='mm',
+                      stroke_width=1 if bold else 0, stroke_fill=color)
+
+def draw_radar_mpl(ax, spec):
+    """matplotlib 備援引擎用：畫在一般 (非極座標) 的 axes 上"""
+    ax.set_xlim(-RADAR_EXTENT, RADAR_EXTENT)
+    ax.set_ylim(RADAR_EXTENT, -RADAR_EXTENT)
+    ax.set_aspect('equal')
+    ax.axis('off')
+    px = 72 / 150   # 像素 -> 點 (dpi=150)
+    for kind, *args in spec:
+        if kind == "polygon":
+            pts, fill, alpha, stroke, width = args
+            ax.add_patch(plt.Polygon(pts, closed=True, linewidth=width * px, edgecolor=stroke,
+                                     facecolor=matplotlib.colors.to_rgba(fill, alpha) if fill else 'none'))
+        elif kind == "line":
+            (x1, y1), (x2, y2), color, width, dash = args
+            ax.plot([x1, x2], [y1, y2], color=color, linewidth=width * px,
+                    linestyle=(0, (dash / width, dash / width)))
+        elif kind == "circle":
+            p, r, color = args
+            ax.add_patch(plt.Circle(p, r, color=color, zorder=5))
+        else:
+            (x, y), txt, size, color, bold = args
+            ax.text(x, y, txt, fontsize=size, color=color, ha='center', va='center',
+                    fontfamily=CN_FONT_NAME, fontweight='bold' if bold else 'normal')
+
+def draw_radar_pdf(pdf, spec, x, y, w, font):
+    """PDF 用：以向量圖元畫在 (x, y) 起、邊長 w (mm) 的方框內"""
+    s = w / (2 * RADAR_EXTENT)
+
+    def at(p):
+        return x + (p[0] + RADAR_EXTENT) * s, y + (p[1] + RADAR_EXTENT) * s
+
+    pdf.set_fill_color(*hex_rgb(RADAR_BG))
+    pdf.rect(x, y, w, w, 'F')
+    for kind, *args in spec:
+        if kind == "polygon":
+            pts, fill, alpha, stroke, width = args
+            pts = [at(p) for p in pts]
+            pdf.set_draw_color(*hex_rgb(stroke))
+            pdf.set_line_width(width * s)
+            if fill and hasattr(pdf, "polygon"):
+                # PDF 這裡不使用透明度，改為預先與背景色混合
+                fg, bg = hex_rgb(fill), hex_rgb(RADAR_BG)
+                pdf.set_fill_color(*(round(f * alpha + b * (1 - alpha)) for f, b in zip(fg, bg)))
+                pdf.polygon(pts, fill=True)
+            else:
+                for a, b in zip(pts, pts[1:] + pts[:1]):
+                    pdf.line(*a, *b)
+        elif kind == "line":
+            p1, p2, color, width, dash = args
+            pdf.set_draw_color(*hex_rgb(color))
+            pdf.set_line_width(width * s)
+            pdf.dashed_line(*at(p1), *at(p2), dash * s, dash * s)
+        elif kind == "circle":
+            p, r, color = args
+            cx, cy = at(p)
+            pdf.set_fill_color(*hex_rgb(color))
+            pdf.ellipse(cx - r * s, cy - r * s, 2 * r * s, 2 * r * s, 'F')
+        else:
+            p, txt, size, color, bold = args
+            size_mm = size * PIL_DPI_SCALE * s
+            pdf.set_font(font, size=size_mm * 72 / 25.4)
+            pdf.set_text_color(*hex_rgb(color))
+            cx, cy = at(p)
+            pdf.text(cx - pdf.get_string_width(txt) / 2, cy + size_mm * 0.35, txt)
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_line_width(0.2)
 
 # --- PDF 生成函式 ---
-def create_pdf(name, profile_name, profile_data, scores):
+def new_report_pdf():
+    """建立已加入一頁並註冊中文字型的 FPDF，回傳 (pdf, 字型名稱)"""
     pdf = FPDF()
     pdf.add_page()
-    
+
     # 註冊中文字型 (自動偵測平台)
     font_to_use = "Arial"
     if CN_FONT_PATH and os.path.exists(CN_FONT_PATH):
@@ -79,6 +998,10 @@ def create_pdf(name, profile_name, profile_data, scores):
             pdf.set_font('Arial', size=12)
     else:
         pdf.set_font('Arial', size=12)
+    return pdf, font_to_use
+
+def create_pdf(name, profile_name, profile_data, scores, percentile_lines=None):
+    pdf, font_to_use = new_report_pdf()
 
     # 標題
     pdf.set_font(font_to_use, size=24)
@@ -95,7 +1018,23 @@ def create_pdf(name, profile_name, profile_data, scores):
     pdf.cell(200, 10, txt=f"火焰 (Blaze): {scores['B']}", ln=True)
     pdf.cell(200, 10, txt=f"節奏 (Tempo): {scores['T']}", ln=True)
     pdf.cell(200, 10, txt=f"鋼鐵 (Steel): {scores['S']}", ln=True)
-    
+
+    # 與其他受測者相比 (百分位)
+    if percentile_lines:
+        pdf.ln(5)
+        pdf.set_font(font_to_use, size=14)
+        pdf.cell(200, 10, txt="與其他受測者相比", ln=True)
+        pdf.set_font(font_to_use, size=12)
+        for line in percentile_lines:
+            pdf.multi_cell(0, 10, txt=line)
+
+    # 能量雷達圖 (與網頁、PNG 同一份圖元，以向量繪製)
+    total = sum(scores.values()) if sum(scores.values()) > 0 else 1
+    pcts = [round((scores[e] / total) * 100) for e in ("D", "B", "T", "S")]
+    chart_y = pdf.get_y() + 5
+    draw_radar_pdf(pdf, radar_chart_spec(*pcts), 55, chart_y, 100, font_to_use)
+    pdf.set_y(chart_y + 100)
+
     # 詳細分析
     pdf.ln(10)
     pdf.set_font(font_to_use, size=14)
@@ -112,15 +1051,306 @@ def create_pdf(name, profile_name, profile_data, scores):
     pdf.ln(5)
     pdf.multi_cell(0, 10, txt=f"成功方程式：{profile_data['success']}")
     pdf.multi_cell(0, 10, txt=f"失敗方程式：{profile_data['failure']}")
-    
+
+    return bytes(pdf.output(dest="S"))
+
+def create_team_pdf(team_name, summary):
+    """團隊報告：整體能量、雷達圖、角色人數、缺少的能量與互補組合"""
+    pdf, font_to_use = new_report_pdf()
+    pct = summary["pct"]
+
+    pdf.set_font(font_to_use, size=24)
+    pdf.cell(200, 20, txt=f"團隊天賦原動力報告：{team_name}", ln=True, align='C')
+    pdf.set_font(font_to_use, size=16)
+    pdf.cell(200, 15, txt=f"成員人數：{summary['members']}", ln=True, align='C')
+
+    pdf.set_font(font_to_use, size=12)
+    pdf.cell(200, 10, txt=f"發電機 {pct['D']}%　火焰 {pct['B']}%　節奏 {pct['T']}%　鋼鐵 {pct['S']}%", ln=True, align='C')
+    chart_y = pdf.get_y() + 5
+    draw_radar_pdf(pdf, radar_chart_spec(pct['D'], pct['B'], pct['T'], pct['S']), 45, chart_y, 120, font_to_use)
+
+    pdf.add_page()
+    pdf.set_font(font_to_use, size=14)
+    pdf.cell(200, 10, txt="角色人數", ln=True)
+    pdf.set_font(font_to_use, size=12)
+    for profile, count in summary["profiles"]:
+        pdf.cell(200, 8, txt=f"{profile}：{count} 人", ln=True)
+
+    pdf.ln(5)
+    pdf.set_font(font_to_use, size=14)
+    pdf.cell(200, 10, txt="缺少的能量與角色", ln=True)
+    pdf.set_font(font_to_use, size=12)
+    pdf.multi_cell(0, 8, txt=f"沒有任何成員角色涵蓋的能量：{'、'.join(summary['uncovered_energies']) or '無'}")
+    pdf.multi_cell(0, 8, txt=f"角色：{'、'.join(summary['missing_profiles']) or '無'}")
+
+    pdf.ln(5)
+    pdf.set_font(font_to_use, size=14)
+    pdf.cell(200, 10, txt="互補組合", ln=True)
+    pdf.set_font(font_to_use, size=12)
+    for a, b, relation, pairs in summary["complements"]:
+        pdf.cell(200, 8, txt=f"{a} × {b}（{relation}）：{pairs} 組", ln=True)
+    for profile, partners in summary["unpaired"]:
+        pdf.multi_cell(0, 8, txt=f"{profile} 團隊中缺少拍檔：{'、'.join(partners)}")
+
     return bytes(pdf.output(dest="S"))
 
-# 1. 設置頁面配置
-st.set_page_config(page_title="Talent Dynamics 天賦評測系統", page_icon="📈", layout="centered")
+# --- 結果圖片生成 ---
+def generate_result_image_mpl(uname, profile_short, d_pct, b_pct, t_pct, s_pct,
+                              name_label='姓名：', title='我的天賦原動力圖表'):
+    """以 matplotlib 生成包含所有資訊的結果圖片 (備援引擎)"""
+    fig_img, axes = plt.subplots(2, 1, figsize=(10, 14), 
+                                  gridspec_kw={'height_ratios': [1.8, 8]},
+                                  facecolor='#0f172a')
+    
+    # 上半部：資訊區
+    ax_info = axes[0]
+    ax_info.set_facecolor('#0f172a')
+    ax_info.axis('off')
+    ax_info.set_xlim(0, 10)
+    ax_info.set_ylim(0, 3)
+    
+    # 姓名
+    ax_info.text(0.3, 2.5, name_label, fontsize=16, color='#94a3b8',
+                 fontfamily=CN_FONT_NAME, fontweight='bold', va='center')
+    ax_info.add_patch(plt.Rectangle((1.8, 2.25), 3, 0.55, facecolor='#334155', 
+                                     edgecolor='none', transform=ax_info.transData))
+    ax_info.text(2.0, 2.5, uname, fontsize=16, color='#60a5fa',
+                 fontfamily=CN_FONT_NAME, va='center')
+    
+    # 主要類別
+    ax_info.text(0.3, 1.8, '主要類別：', fontsize=16, color='#94a3b8',
+                 fontfamily=CN_FONT_NAME, fontweight='bold', va='center')
+    ax_info.add_patch(plt.Rectangle((2.5, 1.55), 2.5, 0.55, facecolor='#334155',
+                                     edgecolor='none', transform=ax_info.transData))
+    ax_info.text(2.7, 1.8, profile_short, fontsize=16, color='#60a5fa',
+                 fontfamily=CN_FONT_NAME, va='center')
+    
+    # 標題列
+    ax_info.add_patch(plt.Rectangle((0, 0.8), 10, 0.6, facecolor='#1e3a8a',
+                                     edgecolor='none', transform=ax_info.transData))
+    ax_info.text(5, 1.1, title, fontsize=20, color='white',
+                 fontfamily=CN_FONT_NAME, fontweight='bold',
+                 ha='center', va='center')
+    
+    # 能量百分比列
+    ax_info.add_patch(plt.Rectangle((0, 0.2), 10, 0.55, facecolor='#1e293b',
+                                     edgecolor='none', transform=ax_info.transData))
+    energy_labels = [
+        (1.2, f'發電機：{d_pct}%', '#fbbf24'),
+        (3.7, f'火焰：{b_pct}%', '#f87171'),
+        (6.2, f'節奏：{t_pct}%', '#a78bfa'),
+        (8.7, f'鋼鐵：{s_pct}%', '#60a5fa'),
+    ]
+    for ex, etxt, ecol in energy_labels:
+        ax_info.text(ex, 0.47, etxt, fontsize=13, color=ecol,
+                     fontfamily=CN_FONT_NAME, fontweight='bold', va='center')
+    
+    # 下半部：雷達圖
+    ax_radar = axes[1]
+    ax_radar.set_facecolor('#0f172a')
+    ax_radar.axis('off')
+    radar_ax = fig_img.add_axes([0.1, 0.05, 0.8, 0.6], facecolor='#0f172a')
+    draw_radar_mpl(radar_ax, radar_chart_spec(d_pct, b_pct, t_pct, s_pct))
+    
+    plt.subplots_adjust(hspace=0.05)
+    
+    buf = io.BytesIO()
+    fig_img.savefig(buf, format='png', dpi=150, bbox_inches='tight',
+                    facecolor='#0f172a', edgecolor='none')
+    buf.seek(0)
+    plt.close(fig_img)
+    return buf.getvalue()
+
+# --- Pillow 直接繪圖 (預設引擎) ---
+# 版面與 matplotlib 版相同，但不經過 figure/axes 與 bbox_inches='tight' 的排版流程
+IMAGE_ENGINE = os.environ.get("TD_IMAGE_ENGINE", "pillow")
+PIL_DPI_SCALE = 150 / 72   # 與 matplotlib dpi=150 時的字級一致
+PIL_FONT_SIZES = (10, 11, 12, 13, 16, 20)
+
+@st.cache_resource
+def load_pil_fonts():
+    """載入各字級的 CJK 字型 (每個行程只載一次)，無法使用 Pillow 時回傳 None"""
+    if Image is None or not (CN_FONT_PATH and os.path.exists(CN_FONT_PATH)):
+        return None
+    # Noto Sans CJK 的 .ttc 依序為 JP/KR/SC/TC/HK，繁中取第 4 個
+    index = 3 if 'NotoSansCJK' in os.path.basename(CN_FONT_PATH) else 0
+    try:
+        return {size: ImageFont.truetype(CN_FONT_PATH, round(size * PIL_DPI_SCALE), index=index)
+                for size in PIL_FONT_SIZES}
+    except OSError:
+        return None
+
+@st.cache_resource
+def get_mpl_lock():
+    return threading.Lock()
+
+def generate_result_image_pil(uname, profile_short, d_pct, b_pct, t_pct, s_pct, fonts,
+                              name_label='姓名：', title='我的天賦原動力圖表'):
+    """以 Pillow 直接繪製結果圖片"""
+    # 尺寸與座標比例取自 matplotlib 版裁切後的輸出 (dpi=150)
+    width, height = 1360, 1784
+    info_x0, unit = 110, 116.3     # 資訊區 x 座標 0~10
+    img = Image.new('RGB', (width, height), '#0f172a')
+    draw = ImageDraw.Draw(img)
+
+    def info_xy(x, y):
+        return info_x0 + x * unit, 12 + (3 - y) * 96
+
+    def info_rect(x, y, w, h, color):
+        x0, y1 = info_xy(x, y)
+        x1, y0 = info_xy(x + w, y + h)
+        draw.rectangle([x0, y0, x1, y1], fill=color)
+
+    def text(xy, txt, size, color, anchor='lm', bold=False):
+        draw.text(xy, txt, font=fonts[size], fill=color, anchor=anchor,
+                  stroke_width=1 if bold else 0, stroke_fill=color)
+
+    # 上半部：資訊區
+    text(info_xy(0.3, 2.5), name_label, 16, '#94a3b8', bold=True)
+    info_rect(1.8, 2.25, 3, 0.55, '#334155')
+    text(info_xy(2.0, 2.5), uname, 16, '#60a5fa')
+
+    text(info_xy(0.3, 1.8), '主要類別：', 16, '#94a3b8', bold=True)
+    info_rect(2.5, 1.55, 2.5, 0.55, '#334155')
+    text(info_xy(2.7, 1.8), profile_short, 16, '#60a5fa')
+
+    info_rect(0, 0.8, 10, 0.6, '#1e3a8a')
+    text(info_xy(5, 1.1), title, 20, 'white', anchor='mm', bold=True)
+
+    info_rect(0, 0.2, 10, 0.55, '#1e293b')
+    energy_labels = [
+        (1.2, f'發電機：{d_pct}%', '#fbbf24'),
+        (3.7, f'火焰：{b_pct}%', '#f87171'),
+        (6.2, f'節奏：{t_pct}%', '#a78bfa'),
+        (8.7, f'鋼鐵：{s_pct}%', '#60a5fa'),
+    ]
+    for ex, etxt, ecol in energy_labels:
+        text(info_xy(ex, 0.47), etxt, 13, ecol, bold=True)
+
+    # 下半部：雷達圖
+    draw_radar_pil(img, radar_chart_spec(d_pct, b_pct, t_pct, s_pct), (673, 1127), fonts)
+
+    buf = io.BytesIO()
+    img.save(buf, format='png')
+    return buf.getvalue()
+
+def generate_result_image(uname, profile_short, d_pct, b_pct, t_pct, s_pct, fonts, mpl_lock,
+                          name_label='姓名：', title='我的天賦原動力圖表'):
+    """依 TD_IMAGE_ENGINE 選擇繪圖引擎，Pillow 不可用或字型無法繪製時退回 matplotlib
+
+    會在背景執行緒中執行，fonts 與 mpl_lock 須先在主執行緒取得
+    (load_pil_fonts()、get_mpl_lock()) 再傳入。
+    """
+    if IMAGE_ENGINE == "pillow" and fonts:
+        try:
+            return generate_result_image_pil(uname, profile_short, d_pct, b_pct, t_pct, s_pct, fonts,
+                                             name_label, title)
+        except OSError:
+            # 只有字型載入/繪字失敗才退回；程式錯誤照常拋出，不會默默改走較慢的 matplotlib
+            pass
+    # pyplot 的全域狀態不是執行緒安全的，背景繪製時需逐一進行
+    with mpl_lock:
+        return generate_result_image_mpl(uname, profile_short, d_pct, b_pct, t_pct, s_pct,
+                                         name_label, title)
+
+# --- 效能剖析 (管理員) ---
+# 以 ?profile=1&admin=<token> 或 TD_PROFILE=1 開啟；每次 rerun 寫出 flamegraph 可用的 folded stacks
+ADMIN_TOKEN = os.environ.get("TD_ADMIN_TOKEN", "")
+PROFILE_DIR = os.environ.get("TD_PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL = 0.002
+
+def is_admin_request():
+    """管理功能需帶 ?admin=<TD_ADMIN_TOKEN>，未設定 token 時一律關閉"""
+    # 以 bytes 比較：compare_digest 遇到非 ASCII 的 str 會丟 TypeError
+    return bool(ADMIN_TOKEN) and secrets.compare_digest(
+        st.query_params.get("admin", "").encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+class RerunProfiler:
+    """單次 rerun 的取樣剖析器，另外記錄各區段的實際耗時"""
+    def __init__(self, label):
+        self.label = label
+        self.sections = []
+        self.stacks = Counter()
+        self._started = self._last_lap = time.perf_counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True, name="td-profiler")
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def lap(self, name):
+        """把上一次 lap 到現在的時間記在 name 底下"""
+        now = time.perf_counter()
+        self.sections.append((name, now - self._last_lap))
+        self._last_lap = now
+
+    def finish(self):
+        self.lap("(rest)")
+        self._stop.set()
+        self._sampler.join()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        total_ms = (time.perf_counter() - self._started) * 1000
+        base = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}_{self.label}_{total_ms:.0f}ms")
+        # 取樣堆疊：每列「frame;frame;... 次數」，可直接餵給 flamegraph.pl 或 speedscope
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
+        # 區段耗時 (微秒)，同樣是 folded 格式
+        with open(base + ".sections.folded", "w", encoding="utf-8") as f:
+            for name, seconds in self.sections:
+                f.write(f"{self.label};{name} {round(seconds * 1e6)}\n")
+
+PROFILER = None
+
+def profile_lap(name):
+    if PROFILER is not None:
+        PROFILER.lap(name)
+
+def profiled_job(name, render_fn):
+    """剖析開啟時，背景繪製工作的耗時另外附加到 render_jobs.sections.folded"""
+    if PROFILER is None:
+        return render_fn
+    def _timed():
+        started = time.perf_counter()
+        try:
+            return render_fn()
+        finally:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, "render_jobs.sections.folded"), "a", encoding="utf-8") as f:
+                f.write(f"render;{name} {round((time.perf_counter() - started) * 1e6)}\n")
+    return _timed
+
+# 上一次 rerun 若被 st.rerun()/st.stop() 中斷，在這裡補寫剖析結果
+if st.session_state.get("profiler") is not None:
+    st.session_state.pop("profiler").finish()
+if os.environ.get("TD_PROFILE") == "1" or (st.query_params.get("profile") == "1" and is_admin_request()):
+    PROFILER = RerunProfiler("results" if st.session_state.get("logged") else f"step{st.session_state.get('step', 0)}")
+    st.session_state.profiler = PROFILER
+
+# 1. 設置頁面配置 (依租戶品牌)
+TENANT = get_tenant_registry().get(resolve_tenant_id())
+BRANDING = TENANT["branding"]
+st.set_page_config(page_title=BRANDING.get("page_title", "Talent Dynamics 天賦評測系統"),
+                   page_icon=BRANDING.get("page_icon", "📈"), layout="centered")
+if TENANT["config_error"]:
+    # 設定無法使用時不改用其他題庫，避免受測者在不知情下作答別的問卷
+    st.error(f"此測驗的設定有誤，暫時無法使用：{TENANT['config_error']}")
+    st.stop()
 
-# 2. 自定義樣式
-st.markdown("""
-<style>
+# 2. 自定義樣式 (壓縮後寫成 static/ 下的內容雜湊檔，每個瀏覽器 session 只注入一次 <link>)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+THEME_CSS = """
     /* 全域深色背景 */
     .stApp {
         background-color: #0f172a; /* Slate 900 */
@@ -172,7 +1402,7 @@ st.markdown("""
         padding: 30px;
         border-radius: 16px;
         border: 1px solid #334155;
-        border-bottom: 4px solid #3b82f6; # Blue 500
+        border-bottom: 4px solid #3b82f6; /* Blue 500 */
         box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.3);
         margin-bottom: 30px;
     }
@@ -208,12 +1438,6 @@ st.markdown("""
         flex: 1 1 20%; /* 每行大約 4-5 個 */
         min-width: 100px;
         text-align: center;
-    }
-        font-size: 1.4em;
-        font-weight: bold;
-        color: #cbd5e1;
-        width: 25%; 
-        border-right: 1px solid #475569;
     }
     .stat-item:last-child { border-right: none; }
 
@@ -359,8 +1583,66 @@ st.markdown("""
     @media (max-width: 768px) {
         .report-card { flex-direction: column; }
     }
-</style>
-""", unsafe_allow_html=True)
+"""
+
+def minify_css(css):
+    """去掉註解與多餘空白"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+def build_theme_css(branding):
+    css = THEME_CSS
+    # 租戶主色 (覆蓋按鈕與進度條)
+    if branding.get("accent_color"):
+        accent = branding["accent_color"]
+        css += f"""
+    .stButton > button {{ background-color: {accent} !important; }}
+    .stProgress > div > div > div > div {{ background-image: none; background-color: {accent}; }}
+"""
+    return minify_css(css)
+
+@st.cache_resource(show_spinner=False)
+def publish_static_css(css):
+    """寫成 static/theme.<雜湊>.css；內容不變檔名就不變，可以放心讓瀏覽器/CDN 長期快取"""
+    digest = hashlib.sha256(css.encode("utf-8")).hexdigest()[:16]
+    name = f"theme.{digest}.css"
+    path = os.path.join(STATIC_DIR, name)
+    if not os.path.exists(path):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=STATIC_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(css)
+        os.replace(tmp, path)
+    return f"app/static/{name}"
+
+def inject_theme(css):
+    # 沒開 server.enableStaticServing 時退回舊作法：每次 rerun 內嵌 <style>
+    if not st.get_option("server.enableStaticServing"):
+        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
+        return
+    href = publish_static_css(css)
+    if st.session_state.get("theme_href") == href:
+        return
+    st.session_state.theme_href = href
+    # <link> 掛在主頁面的 <head>，不受 rerun 重繪影響，之後的 rerun 不必再送 CSS
+    st.html(f"""
+<script>
+    const doc = document;
+    if (!doc.querySelector('link[data-td-theme="{href}"]')) {{
+        doc.querySelectorAll('link[data-td-theme]').forEach(el => el.remove());
+        const link = doc.createElement('link');
+        link.rel = 'stylesheet';
+        link.href = '{href}';
+        link.dataset.tdTheme = '{href}';
+        doc.head.appendChild(link);
+    }}
+</script>
+""", unsafe_allow_javascript=True)
+
+inject_theme(build_theme_css(BRANDING))
+profile_lap("css")
 
 # 3. 定義模型與完整 26 題庫 (加入 Emoji)
 questions = [
@@ -528,6 +1810,18 @@ profile_details = {
     }
 }
 
+# 租戶自訂題庫與角色文字
+if TENANT["questions"]:
+    questions = TENANT["questions"]
+if TENANT["profile_details"]:
+    # 租戶只覆寫文字欄位；角色名稱由 determine_profile 決定，不能增減或改名
+    unknown_profiles = set(TENANT["profile_details"]) - set(profile_details)
+    if unknown_profiles:
+        st.error(f"此測驗的設定有誤，暫時無法使用：未知的角色 {'、'.join(sorted(unknown_profiles))}")
+        st.stop()
+    profile_details = {name: {**detail, **TENANT["profile_details"].get(name, {})}
+                       for name, detail in profile_details.items()}
+
 # 4. 初始化 Session State (使用 responses 記錄每題答案)
 if 'responses' not in st.session_state:
     st.session_state.responses = {}
@@ -535,91 +1829,537 @@ if 'step' not in st.session_state:
     st.session_state.step = 0
 if 'uname' not in st.session_state:
     st.session_state.uname = ""
+# 切換租戶時重新開始，避免不同題庫的答案混用
+if st.session_state.get('tenant_id') != TENANT["id"]:
+    st.session_state.responses = {}
+    st.session_state.step = 0
+    st.session_state.uname = ""
+    st.session_state.pop("logged", None)
+    st.session_state.pop("report_meta", None)
+    st.session_state.pop("ckpt_token", None)
+    st.session_state.tenant_id = TENANT["id"]
+
+# 從網址 ?sid= 還原進度 (例如 replica 被回收後重新連線)
+if 'ckpt_token' not in st.session_state:
+    token = st.query_params.get("sid", "")
+    saved = get_checkpoint_store().load(TENANT["id"], token) if SESSION_TOKEN_RE.match(token) else None
+    if saved:
+        uname, step, answers, logged, report = saved
+        st.session_state.uname = uname
+        st.session_state.step = step
+        st.session_state.responses = decode_answers(answers)
+        if logged:
+            st.session_state.logged = True
+        if report:
+            st.session_state.report_meta = json.loads(report)
+    else:
+        token = secrets.token_urlsafe(16)
+    st.session_state.ckpt_token = token
+    st.session_state.ckpt_last = saved
+if st.query_params.get("sid") != st.session_state.ckpt_token:
+    st.query_params["sid"] = st.session_state.ckpt_token
+checkpoint_session(len(questions))
 
 # 5. 邏輯處理
-def calculate_scores():
+def calculate_scores(responses=None):
+    if responses is None:
+        responses = st.session_state.responses
     scores = {"D": 0, "B": 0, "T": 0, "S": 0}
-    for q_idx, energy in st.session_state.responses.items():
+    for q_idx, energy in responses.items():
         if energy in scores:
             scores[energy] += 1
     return scores
 
+def determine_profile(scores):
+    """依最高與次高的能量判定天賦角色 (同分時依 D/B/T/S 的順序)"""
+    sorted_freqs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    top1 = sorted_freqs[0][0]
+    top2 = sorted_freqs[1][0]
+    
+    if top1 == "D":
+        return "創作者 (Creator)" if top2 not in ["B", "S"] else ("明星 (Star)" if top2 == "B" else "技師 (Mechanic)")
+    elif top1 == "B":
+        return "支持者 (Supporter)" if top2 not in ["D", "T"] else ("明星 (Star)" if top2 == "D" else "媒合者 (Deal Maker)")
+    elif top1 == "T":
+        return "商人 (Trader)" if top2 not in ["B", "S"] else ("媒合者 (Deal Maker)" if top2 == "B" else "積蓄者 (Accumulator)")
+    else: # Steel
+        return "地主 (Lord)" if top2 not in ["D", "T"] else ("技師 (Mechanic)" if top2 == "D" else "積蓄者 (Accumulator)")
+
+# 適性模式：剩下的題目怎麼答都不會改變角色時就提早結束
+ADAPTIVE_MODE = (os.environ.get("TD_ADAPTIVE") == "1"
+                 or st.query_params.get("adaptive") in ("1", "true")
+                 or TENANT["adaptive"])
+
+def profile_is_locked(scores, responses, bank):
+    """列舉剩餘題目所有可能的作答組合，角色都相同時回傳 True"""
+    energies = list(scores)
+    remaining = [q for i, q in enumerate(bank) if i not in responses]
+    if not remaining:
+        return True
+
+    # 不在前兩名的能量若拿下所有剩餘題目就能擠進前兩名，角色必定會變
+    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    second = ranked[1][1]
+    if any(count + len(remaining) > second for _, count in ranked[2:]):
+        return False
+
+    # 各能量可能增加的票數組合 (最多 C(n+3, 3) 種)
+    reachable = {(0,) * len(energies)}
+    for q in remaining:
+        choices = {energies.index(e) for e in q["opts"].values()}
+        reachable = {add[:i] + (add[i] + 1,) + add[i + 1:] for add in reachable for i in choices}
+
+    final_profile = determine_profile(scores)
+    for add in reachable:
+        if determine_profile({e: scores[e] + add[i] for i, e in enumerate(energies)}) != final_profile:
+            return False
+    return True
+
+# --- 題庫模擬器 (管理員) ---
+# 以 NumPy 批次產生虛擬受測者，評估題庫或選項對應改動後的角色分佈
+SIM_ENERGIES = "DBTS"
+SIM_BATCH = 100_000
+
+def bank_option_energies(bank):
+    """題庫轉成 (題數, 最多選項數) 的能量索引矩陣，不足的選項補 -1"""
+    max_opts = max(len(q["opts"]) for q in bank)
+    opt_energy = np.full((len(bank), max_opts), -1, dtype=np.int8)
+    for qi, q in enumerate(bank):
+        for oi, energy in enumerate(q["opts"].values()):
+            opt_energy[qi, oi] = SIM_ENERGIES.index(energy)
+    return opt_energy
+
+def profile_lookup_table(profile_names):
+    """top1 × top2 → 角色編號，直接沿用 determine_profile 的規則"""
+    table = np.zeros((4, 4), dtype=np.int8)
+    for a in range(4):
+        for b in range(4):
+            if a != b:
+                scores = {e: 0 for e in SIM_ENERGIES}
+                scores[SIM_ENERGIES[a]], scores[SIM_ENERGIES[b]] = 2, 1
+                table[a, b] = profile_names.index(determine_profile(scores))
+    return table
+
+def empirical_option_probs(bank, opt_energy, results_path):
+    """由歷史紀錄估計每題各能量的選擇比例 (加一平滑)"""
+    energy_counts = np.ones((len(bank), 4))
+    if os.path.isfile(results_path):
+        q_cols = [f"Q{i+1}" for i in range(len(bank))]
+        log_df = pd.read_csv(results_path, encoding="utf-8-sig", usecols=lambda c: c in q_cols, dtype=str)
+        for qi, col in enumerate(q_cols):
+            if col in log_df:
+                counts = log_df[col].value_counts()
+                for ei, energy in enumerate(SIM_ENERGIES):
+                    energy_counts[qi, ei] += counts.get(energy, 0)
+    valid = opt_energy >= 0
+    probs = np.where(valid, np.take_along_axis(energy_counts, np.where(valid, opt_energy, 0), axis=1), 0)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+def sample_options(rng, n, opt_energy, model, empirical_probs=None, bias_alpha=1.0):
+    """依受測者模型抽出每人每題選了第幾個選項，回傳 (n, 題數)"""
+    n_q, max_opts = opt_energy.shape
+    valid = opt_energy >= 0
+    safe_energy = np.where(valid, opt_energy, 0)
+    # 逐選項處理，只用 (n, 題數) 大小的陣列，不展開成三維
+    if model == "biased":
+        # 每人有自己的能量偏好 (Dirichlet)，選項機率與其能量的權重成正比
+        weights = rng.dirichlet([bias_alpha] * 4, size=n).astype(np.float32)
+        probs = [np.where(valid[:, m], weights[:, safe_energy[:, m]], 0) for m in range(max_opts)]
+    else:
+        base = valid / valid.sum(axis=1, keepdims=True) if model == "uniform" else empirical_probs
+        probs = [base[:, m].astype(np.float32) for m in range(max_opts)]
+
+    u = rng.random((n, n_q), dtype=np.float32) * sum(probs)
+    opts = np.zeros((n, n_q), dtype=np.int8)
+    threshold = 0
+    for m in range(max_opts - 1):
+        threshold = threshold + probs[m]
+        opts += u >= threshold
+    return np.minimum(opts, valid.sum(axis=1) - 1)
+
+def simulate_question_bank(bank, n, model="uniform", seed=0, results_path=None, bias_alpha=1.0):
+    """模擬 n 位受測者，回傳角色分佈、同分率與各題對結果的影響 (互資訊)"""
+    rng = np.random.default_rng(seed)
+    profile_names = list(profile_details)
+    opt_energy = bank_option_energies(bank)
+    table = profile_lookup_table(profile_names)
+    empirical_probs = empirical_option_probs(bank, opt_energy, results_path) if model == "empirical" else None
+    n_q, max_opts = opt_energy.shape
+    n_p = len(profile_names)
+
+    profile_counts = np.zeros(n_p, dtype=np.int64)
+    top1_ties = top2_ties = 0
+    # 每題「選項 × 角色」的列聯表，用來計算互資訊
+    joint = np.zeros((n_q, max_opts, n_p), dtype=np.int64)
+    q_offsets = (np.arange(n_q) * max_opts * n_p)[None, :]
+
+    for start in range(0, n, SIM_BATCH):
+        size = min(SIM_BATCH, n - start)
+        opts = sample_options(rng, size, opt_energy, model, empirical_probs, bias_alpha)
+        energies = opt_energy[np.arange(n_q), opts]
+        counts = np.stack([(energies == e).sum(axis=1) for e in range(4)], axis=1)
+
+        # 穩定排序：同分時依 D/B/T/S 順序，與 determine_profile 相同
+        order = np.argsort(-counts, axis=1, kind="stable")
+        profiles = table[order[:, 0], order[:, 1]]
+        profile_counts += np.bincount(profiles, minlength=n_p)
+
+        ranked = np.take_along_axis(counts, order, axis=1)
+        top1_ties += int((ranked[:, 0] == ranked[:, 1]).sum())
+        top2_ties += int((ranked[:, 1] == ranked[:, 2]).sum())
+
+        cells = q_offsets + opts * n_p + profiles[:, None]
+        joint += np.bincount(cells.ravel(), minlength=joint.size).reshape(joint.shape)
+
+    # 互資訊 I(題目選項; 角色)，單位 bits
+    p_joint = joint / n
+    p_opt = p_joint.sum(axis=2, keepdims=True)
+    p_prof = p_joint.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mi_terms = np.where(p_joint > 0, p_joint * np.log2(p_joint / (p_opt * p_prof)), 0)
+    influence = mi_terms.sum(axis=(1, 2))
+
+    return {
+        "profiles": pd.DataFrame({
+            "角色": profile_names,
+            "人數": profile_counts,
+            "比例%": np.round(profile_counts / n * 100, 2),
+        }),
+        "top1_tie_rate": top1_ties / n,
+        "top2_tie_rate": top2_ties / n,
+        "influence": pd.DataFrame({
+            "題目": [f"Q{i+1}" for i in range(n_q)],
+            "互資訊 (bits)": np.round(influence, 4),
+        }),
+    }
+
+def render_simulator_page():
+    st.title("🎲 題庫模擬器")
+    st.caption("以虛擬受測者預估題庫改動後的角色分佈；上傳 JSON 題庫可與目前題庫比較。")
+    model_labels = {"uniform": "隨機作答", "biased": "能量偏好 (Dirichlet)", "empirical": "歷史作答比例"}
+    model = st.selectbox("受測者模型", list(model_labels), format_func=model_labels.get)
+    bias_alpha = st.slider("偏好集中度 α (越小越極端)", 0.1, 5.0, 1.0) if model == "biased" else 1.0
+    n = st.number_input("模擬人數", min_value=10_000, max_value=20_000_000, value=1_000_000, step=100_000)
+    uploaded = st.file_uploader("候選題庫 (JSON，格式同 questions)", type="json")
+
+    if st.button("開始模擬"):
+        banks = {"目前題庫": questions}
+        if uploaded is not None:
+            banks["候選題庫"] = json.load(uploaded)
+        cols = st.columns(len(banks))
+        for col, (label, bank) in zip(cols, banks.items()):
+            started = time.perf_counter()
+            result = simulate_question_bank(bank, int(n), model, results_path=TENANT["results_path"],
+                                            bias_alpha=bias_alpha)
+            with col:
+                st.subheader(label)
+                st.caption(f"耗時 {time.perf_counter() - started:.2f} 秒")
+                st.dataframe(result["profiles"], hide_index=True)
+                st.write(f"第一名同分率：{result['top1_tie_rate']:.2%}　第二名同分率：{result['top2_tie_rate']:.2%}")
+                st.dataframe(result["influence"], hide_index=True)
+
+# --- 查詢過去的結果 ---
+def render_stored_report(ts, name, answers):
+    """以紀錄中的答案重新計算並產生報告下載"""
+    responses = decode_answers(answers)
+    scores = calculate_scores(responses)
+    final_profile = determine_profile(scores)
+    p_data = profile_details[final_profile]
+    profile_short = final_profile.split(' ')[0]
+    total = sum(scores.values()) if sum(scores.values()) > 0 else 1
+    d_pct = round((scores["D"] / total) * 100)
+    b_pct = round((scores["B"] / total) * 100)
+    t_pct = round((scores["T"] / total) * 100)
+    s_pct = round((scores["S"] / total) * 100)
+
+    st.markdown(f"""
+    <div class="result-header">{name}｜{profile_short}</div>
+    <div class="result-stats">
+        <div class="stat-item"><span style="color:#fbbf24">發電機：</span> {d_pct}%</div>
+        <div class="stat-item"><span style="color:#f87171">火焰：</span> {b_pct}%</div>
+        <div class="stat-item"><span style="color:#a78bfa">節奏：</span> {t_pct}%</div>
+        <div class="stat-item"><span style="color:#60a5fa">鋼鐵：</span> {s_pct}%</div>
+    </div>
+    """, unsafe_allow_html=True)
+    st.markdown(radar_svg(radar_chart_spec(d_pct, b_pct, t_pct, s_pct)), unsafe_allow_html=True)
+    st.caption(f"測驗時間：{ts}")
+
+    answers_key = tuple(responses.get(i, "") for i in range(len(questions)))
+    render_service = get_render_service()
+    img_job = render_service.submit(
+        TENANT, ("png", name, answers_key),
+        lambda fonts=load_pil_fonts(), mpl_lock=get_mpl_lock():
+            generate_result_image(name, profile_short, d_pct, b_pct, t_pct, s_pct, fonts, mpl_lock))
+    pdf_job = render_service.submit(
+        TENANT, ("pdf", name, answers_key),
+        lambda: create_pdf(name, final_profile, p_data, scores))
+    artifact_download_button(img_job, label="📸 截圖下載",
+                             file_name=f"天賦原動力_{name}.png", mime="image/png")
+    artifact_download_button(pdf_job, label="📄 下載完整分析報告 (PDF)",
+                             file_name=f"天賦原動力報告_{name}.pdf", mime="application/pdf")
+
+def render_lookup_page():
+    st.title("🔍 查詢過去的測驗結果")
+    if not is_admin_request():
+        # 一般受測者只能憑結果頁上的查詢代碼取回自己的報告
+        code = st.text_input("結果頁上的查詢代碼：", autocomplete="off", max_chars=RETRIEVAL_CODE_LENGTH)
+        if code:
+            index = get_results_index()
+            row = index.find_by_code(TENANT["id"], code)
+            if row is None:
+                index.sync(TENANT["id"], TENANT["results_path"])
+                row = index.find_by_code(TENANT["id"], code)
+            if row:
+                ts, row_name, _, codes, mask = row
+                render_stored_report(ts, row_name, unpack_answers(codes, mask, len(questions)))
+            else:
+                st.warning("查無此代碼，請確認輸入是否正確。")
+        else:
+            st.info("請輸入完成測驗時取得的查詢代碼。")
+    else:
+        # 依姓名、日期與角色搜尋所有人的紀錄僅限管理員
+        name = st.text_input("測驗時填寫的姓名：", autocomplete="off")
+        col_start, col_end = st.columns(2)
+        start_date = col_start.date_input("起始日期", value=None)
+        end_date = col_end.date_input("結束日期", value=None)
+        profile_filter = st.selectbox("天賦角色", ["全部"] + list(profile_details))
+        profile = None if profile_filter == "全部" else profile_filter
+
+        index = get_results_index()
+        index.sync(TENANT["id"], TENANT["results_path"])
+        rows = index.search(
+            TENANT["id"], name=name,
+            start=f"{start_date} 00:00:00" if start_date else None,
+            end=f"{end_date} 23:59:59" if end_date else None,
+            profile=profile)
+        if rows:
+            choice = st.selectbox("選擇一筆紀錄", range(len(rows)),
+                                  format_func=lambda i: f"{rows[i][0]}｜{rows[i][1]}｜{rows[i][2]}")
+            ts, row_name, _, codes, mask = rows[choice]
+            render_stored_report(ts, row_name, unpack_answers(codes, mask, len(questions)))
+        else:
+            st.warning("查無符合的紀錄，請確認姓名與日期。")
+
+    st.markdown("---")
+    if st.button("⬅️ 返回測驗"):
+        del st.query_params["view"]
+        st.rerun()
+
+# --- 團隊報告 (管理員) ---
+# 從結果索引取出成員最新的紀錄，一次走訪算出團隊能量、角色人數與互補組合
+
+def profile_partners(details):
+    """依 triangle (最佳拍檔) 與 opposite (相反屬性) 建立角色 -> (拍檔集合, 相反角色集合)"""
+    by_short = {p.split(' ')[0]: p for p in details}
+    partners = {}
+    for profile, d in details.items():
+        triangle = {by_short[s] for s in d["triangle"].split("、") if s in by_short} - {profile}
+        if d["opposite"] in by_short:
+            opposite = {by_short[d["opposite"]]}
+        else:
+            # 例如「節奏型天才」：所有帶有節奏能量的角色
+            energy = d["opposite"].replace("型天才", "")
+            opposite = {p for p, dp in details.items() if energy in dp["freq"].split("/")}
+        partners[profile] = (triangle, opposite)
+    return partners
+
+def aggregate_team(members, packed, details):
+    """members 為 [(name, profile)]、packed 為對應的壓縮答案；回傳團隊報告所需的統計"""
+    scores = packed_scores(packed)
+    answered = scores.sum(axis=1)
+    shares = (scores[answered > 0] / answered[answered > 0, None]).sum(axis=0)
+    energy_sum = dict(zip(PACK_ENERGIES, shares.tolist()))
+    counts = Counter(profile for _, profile in members)
+    members = len(members)
+
+    # 角色 freq 涵蓋的能量 (依角色判斷，不看個別答案)
+    covered_energies = {e for p in counts if p in details
+                        for e, name in ENERGY_NAMES.items() if name in details[p]["freq"].split("/")}
+    partners = profile_partners(details)
+    complements, unpaired, seen = [], [], set()
+    for profile in details:
+        if not counts[profile]:
+            continue
+        triangle, opposite = partners[profile]
+        for relation, group in (("最佳拍檔", triangle), ("相反屬性", opposite)):
+            for other in details:
+                pair = (relation, frozenset((profile, other)))
+                # 每一對只列一次；組合數為兩種角色人數相乘
+                if other in group and other != profile and counts[other] and pair not in seen:
+                    seen.add(pair)
+                    complements.append((profile, other, relation, counts[profile] * counts[other]))
+        missing = [p.split(' ')[0] for p in details if p in triangle and not counts[p]]
+        if missing:
+            unpaired.append((profile, missing))
+
+    return {
+        "members": members,
+        "pct": {e: round(energy_sum[e] / members * 100) if members else 0 for e in ENERGY_NAMES},
+        "profiles": counts.most_common(),
+        "uncovered_energies": [name for e, name in ENERGY_NAMES.items() if e not in covered_energies],
+        "missing_profiles": [p for p in details if not counts[p]],
+        "complements": complements,
+        "unpaired": unpaired,
+    }
+
+def render_team_page():
+    st.title("👥 團隊報告")
+    st.caption("彙整多位成員最新的測驗紀錄；名單留白時納入日期範圍內的所有人。")
+    # 按下按鈕才彙整，避免每次 rerun 都走訪整個索引並送出繪製工作
+    with st.form("team_form"):
+        team_name = st.text_input("團隊名稱", value="我的團隊")
+        names = st.text_area("成員姓名 (每行一位)")
+        col_start, col_end = st.columns(2)
+        start_date = col_start.date_input("起始日期", value=None)
+        end_date = col_end.date_input("結束日期", value=None)
+        if st.form_submit_button("產生團隊報告"):
+            st.session_state.team_query = (team_name, names, start_date, end_date)
+    if "team_query" not in st.session_state:
+        st.info("填好條件後按「產生團隊報告」。")
+        return
+    team_name, names, start_date, end_date = st.session_state.team_query
+
+    index = get_results_index()
+    index.sync(TENANT["id"], TENANT["results_path"])
+    members, packed = index.latest_per_person(
+        TENANT["id"], names=names.splitlines(),
+        start=f"{start_date} 00:00:00" if start_date else None,
+        end=f"{end_date} 23:59:59" if end_date else None)
+    if not members:
+        st.warning("查無符合的紀錄，請確認姓名與日期。")
+        return
+    summary = aggregate_team(members, packed, profile_details)
+    pct = summary["pct"]
+    top_short = summary["profiles"][0][0].split(' ')[0]
+
+    st.markdown(f"""
+    <div class="result-header">{team_name}｜{summary['members']} 人</div>
+    <div class="result-stats">
+        <div class="stat-item"><span style="color:#fbbf24">發電機：</span> {pct['D']}%</div>
+        <div class="stat-item"><span style="color:#f87171">火焰：</span> {pct['B']}%</div>
+        <div class="stat-item"><span style="color:#a78bfa">節奏：</span> {pct['T']}%</div>
+        <div class="stat-item"><span style="color:#60a5fa">鋼鐵：</span> {pct['S']}%</div>
+    </div>
+    """, unsafe_allow_html=True)
+    st.dataframe(pd.DataFrame(summary["profiles"], columns=["天賦角色", "人數"]), hide_index=True)
+    st.write(f"沒有任何成員角色涵蓋的能量：{'、'.join(summary['uncovered_energies']) or '無'}")
+    st.write(f"缺少的角色：{'、'.join(p.split(' ')[0] for p in summary['missing_profiles']) or '無'}")
+    if summary["complements"]:
+        st.dataframe(pd.DataFrame(summary["complements"], columns=["角色", "互補角色", "關係", "組合數"]),
+                     hide_index=True)
+    for profile, missing in summary["unpaired"]:
+        st.caption(f"{profile} 團隊中缺少拍檔：{'、'.join(missing)}")
+
+    # 報告只由統計結果決定，以統計內容當快取鍵
+    summary_key = (team_name, summary["members"], tuple(pct.values()), tuple(summary["profiles"]))
+    render_service = get_render_service()
+    render_png = lambda fonts=load_pil_fonts(), mpl_lock=get_mpl_lock(): generate_result_image(
+        team_name, top_short, pct['D'], pct['B'], pct['T'], pct['S'], fonts, mpl_lock,
+        name_label='團隊：', title='團隊天賦原動力圖表')
+    img_job = render_service.submit(TENANT, ("team_png",) + summary_key, render_png)
+    pdf_job = render_service.submit(TENANT, ("team_pdf",) + summary_key,
+                                    lambda: create_team_pdf(team_name, summary))
+    artifact_download_button(img_job, label="📸 下載團隊雷達圖",
+                             file_name=f"團隊天賦原動力_{team_name}.png", mime="image/png")
+    artifact_download_button(pdf_job, label="📄 下載團隊報告 (PDF)",
+                             file_name=f"團隊天賦原動力報告_{team_name}.pdf", mime="application/pdf")
+
 # 6. 介面渲染
+if is_admin_request() and st.query_params.get("view") == "simulator":
+    render_simulator_page()
+    st.stop()
+if is_admin_request() and st.query_params.get("view") == "team":
+    render_team_page()
+    st.stop()
+if st.query_params.get("view") == "lookup":
+    render_lookup_page()
+    st.stop()
+
 if st.session_state.uname == "":
-    st.title("🏹 Talent Dynamics 天賦原動力")
-    st.info("了解你的自然能量，找到阻力最小的路徑。")
+    st.title(BRANDING.get("title", "🏹 Talent Dynamics 天賦原動力"))
+    st.info(BRANDING.get("tagline", "了解你的自然能量，找到阻力最小的路徑。"))
     # 停用瀏覽器自動完成
-    st.markdown('<style>input[type="text"]{autocomplete:off !important;}</style>', unsafe_allow_html=True)
     name = st.text_input("請先輸入受測者姓名：", autocomplete="off")
     if st.button("開始評測 🚀") and name:
         st.session_state.uname = name
         st.rerun()
+    if st.button("🔍 查詢過去的結果"):
+        st.query_params["view"] = "lookup"
+        st.rerun()
 
 elif st.session_state.step < len(questions):
-    # --- 視覺優化：階段提示 ---
-    q_step = st.session_state.step + 1
-    total_q = len(questions)
-    
-    if q_step <= 5:
-        st.markdown("### 🧩 Part 1: 關於你的特質")
-    elif q_step <= 9:
-        st.markdown("### ⚡ Part 2: 你的優勢與地雷")
-    elif q_step <= 15:
-        st.markdown("### 💼 Part 3: 工作與專案偏好")
-    else:
-        st.markdown("### 🏔️ Part 4: 生活與價值觀")
+    # 作答頁 rerun 期間背景繪製讓出 CPU
+    with get_render_service().interactive():
+        # --- 視覺優化：階段提示 ---
+        q_step = st.session_state.step + 1
+        total_q = len(questions)
+    
+        if q_step <= 5:
+            st.markdown("### 🧩 Part 1: 關於你的特質")
+        elif q_step <= 9:
+            st.markdown("### ⚡ Part 2: 你的優勢與地雷")
+        elif q_step <= 15:
+            st.markdown("### 💼 Part 3: 工作與專案偏好")
+        else:
+            st.markdown("### 🏔️ Part 4: 生活與價值觀")
         
-    # 進度條優化
-    st.progress(st.session_state.step / total_q, text=f"進度：{q_step}/{total_q}")
+        # 進度條優化
+        st.progress(st.session_state.step / total_q, text=f"進度：{q_step}/{total_q}")
+        if ADAPTIVE_MODE:
+            st.caption("適性模式：結果確定後會提早結束測驗")
 
-    q_data = questions[st.session_state.step]
+        q_data = questions[st.session_state.step]
     
-    # --- 視覺優化：題目卡片 ---
-    st.markdown(f"""
-    <div style="background-color: #262730; padding: 20px; border-radius: 10px; border: 1px solid #4ade80; margin-bottom: 20px;">
-        <h3 style="margin:0; color: #4ade80;">Q{q_data['id']}. {q_data['q']}</h3>
-    </div>
-    """, unsafe_allow_html=True)
+        # --- 視覺優化：題目卡片 ---
+        st.markdown(f"""
+        <div style="background-color: #262730; padding: 20px; border-radius: 10px; border: 1px solid #4ade80; margin-bottom: 20px;">
+            <h3 style="margin:0; color: #4ade80;">Q{q_data['id']}. {q_data['q']}</h3>
+        </div>
+        """, unsafe_allow_html=True)
     
-    # 選項處理
-    opts_map = {k: v for k, v in q_data["opts"].items()} # Label -> Value
-    opts_labels = list(opts_map.keys())
-    
-    # 檢查是否有已存的答案
-    default_idx = None
-    if st.session_state.step in st.session_state.responses:
-        saved_val = st.session_state.responses[st.session_state.step]
-        # 反查 Label
-        for i, label in enumerate(opts_labels):
-            if opts_map[label] == saved_val:
-                default_idx = i
-                break
+        # 選項處理
+        opts_map = {k: v for k, v in q_data["opts"].items()} # Label -> Value
+        opts_labels = list(opts_map.keys())
+    
+        # 檢查是否有已存的答案
+        default_idx = None
+        if st.session_state.step in st.session_state.responses:
+            saved_val = st.session_state.responses[st.session_state.step]
+            # 反查 Label
+            for i, label in enumerate(opts_labels):
+                if opts_map[label] == saved_val:
+                    default_idx = i
+                    break
     
-    choice = st.radio("選取最符合你的直覺描述：", opts_labels, index=default_idx, key=f"q_{st.session_state.step}")
+        choice = st.radio("選取最符合你的直覺描述：", opts_labels, index=default_idx, key=f"q_{st.session_state.step}")
 
-    # 導航按鈕
-    col_prev, col_next = st.columns([1, 1])
+        # 導航按鈕
+        col_prev, col_next = st.columns([1, 1])
     
-    with col_prev:
-        if st.session_state.step > 0:
-            if st.button("⬅️ 上一題"):
+        with col_prev:
+            if st.session_state.step > 0:
+                if st.button("⬅️ 上一題"):
+                    if choice:
+                        st.session_state.responses[st.session_state.step] = opts_map[choice]
+                    st.session_state.step -= 1
+                    st.rerun()
+            
+        with col_next:
+            if st.button("下一題 ➡️"):
                 if choice:
                     st.session_state.responses[st.session_state.step] = opts_map[choice]
-                st.session_state.step -= 1
-                st.rerun()
-            
-    with col_next:
-        if st.button("下一題 ➡️"):
-            if choice:
-                st.session_state.responses[st.session_state.step] = opts_map[choice]
-                st.session_state.step += 1
-                st.rerun()
-            else:
-                st.warning("請選擇一個選項！")
+                    st.session_state.step += 1
+                    if ADAPTIVE_MODE and profile_is_locked(calculate_scores(), st.session_state.responses, questions):
+                        # 未作答的題目在紀錄中留白，可看出實際出過哪些題
+                        st.session_state.step = len(questions)
+                    st.rerun()
+                else:
+                    st.warning("請選擇一個選項！")
 
-# 7. 結果頁面
+    # 7. 結果頁面
 else:
-    st.balloons()
+    if "logged" not in st.session_state:
+        st.balloons()
     scores = calculate_scores()
     
     # 計算百分比
@@ -630,21 +2370,48 @@ else:
     s_pct = round((scores["S"] / total) * 100)
     
     # 先判定角色 (提前到 header 前，這樣上方能顯示)
-    sorted_freqs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    top1 = sorted_freqs[0][0]
-    top2 = sorted_freqs[1][0]
-    
-    if top1 == "D":
-        final_profile = "創作者 (Creator)" if top2 not in ["B", "S"] else ("明星 (Star)" if top2 == "B" else "技師 (Mechanic)")
-    elif top1 == "B":
-        final_profile = "支持者 (Supporter)" if top2 not in ["D", "T"] else ("明星 (Star)" if top2 == "D" else "媒合者 (Deal Maker)")
-    elif top1 == "T":
-        final_profile = "商人 (Trader)" if top2 not in ["B", "S"] else ("媒合者 (Deal Maker)" if top2 == "B" else "積蓄者 (Accumulator)")
-    else: # Steel
-        final_profile = "地主 (Lord)" if top2 not in ["D", "T"] else ("技師 (Mechanic)" if top2 == "D" else "積蓄者 (Accumulator)")
+    final_profile = determine_profile(scores)
     
     p_data = profile_details[final_profile]
     profile_short = final_profile.split(' ')[0]  # e.g. "技師"
+    profile_lap("scoring")
+
+    # --- 自動紀錄數據 (僅記錄一次)；先寫入，百分位才會包含本次結果 ---
+    results_index = get_results_index()
+    if "logged" not in st.session_state:
+        row_offset = log_results_to_csv(st.session_state.uname, st.session_state.responses, scores, final_profile,
+                                        file_path=TENANT["results_path"], q_count=len(questions))
+        st.session_state.logged = True
+        # 只有剛寫入一列時才補索引，一般 rerun 不搶寫入鎖
+        results_index.sync(TENANT["id"], TENANT["results_path"])
+        code = new_retrieval_code()
+        results_index.add_retrieval_code(TENANT["id"], code, row_offset)
+        st.session_state.report_meta = {"code": code}
+    profile_lap("csv_append")
+
+    # 百分位：與全體及同角色的受測者比較；只在紀錄後算一次，之後沿用 (PDF 快取鍵才不會每次變動)
+    report_meta = st.session_state.setdefault("report_meta", {})
+    if "percentiles" not in report_meta:
+        pcts = {"D": d_pct, "B": b_pct, "T": t_pct, "S": s_pct}
+        ranks = {"all": results_index.percentile_ranks(TENANT["id"], pcts),
+                 "profile": results_index.percentile_ranks(TENANT["id"], pcts, final_profile)}
+        report_meta["percentiles"] = describe_percentiles(pcts, ranks, profile_short)
+        checkpoint_session(len(questions))
+    percentile_lines = report_meta["percentiles"]
+    profile_lap("percentiles")
+
+    # 先把 PNG/PDF 丟到背景繪製，頁面其餘部分照常顯示
+    uname = st.session_state.uname
+    answers_key = tuple(st.session_state.responses.get(i, "") for i in range(len(questions)))
+    render_service = get_render_service()
+    img_job = render_service.submit(
+        TENANT, ("png", uname, answers_key),
+        profiled_job("image", lambda fonts=load_pil_fonts(), mpl_lock=get_mpl_lock():
+            generate_result_image(uname, profile_short, d_pct, b_pct, t_pct, s_pct, fonts, mpl_lock)))
+    pdf_job = render_service.submit(
+        TENANT, ("pdf", uname, answers_key, tuple(percentile_lines)),
+        profiled_job("pdf", lambda: create_pdf(uname, final_profile, p_data, scores, percentile_lines)))
+    profile_lap("render_submit")
 
     # 頂部：姓名 + 主要類別 + 四大能量
     st.markdown(f"""
@@ -668,235 +2435,26 @@ else:
     <br>
     """, unsafe_allow_html=True)
     
-    # 雷達圖數據準備 (八角色 + 四能量)
-    labels = ["創作者", "明星", "支持者", "媒合者", "商人", "積蓄者", "地主", "技師"]
-    r_vals = [
-        d_pct,              # 創作者 (Dynamo)
-        (d_pct + b_pct)/2,  # 明星 (Dynamo/Blaze)
-        b_pct,              # 支持者 (Blaze)
-        (b_pct + t_pct)/2,  # 媒合者 (Blaze/Tempo)
-        t_pct,              # 商人 (Tempo)
-        (t_pct + s_pct)/2,  # 積蓄者 (Tempo/Steel)
-        s_pct,              # 地主 (Steel)
-        (s_pct + d_pct)/2   # 技師 (Steel/Dynamo)
-    ]
-    r_vals.append(r_vals[0])
-    labels.append(labels[0])
-    
-    fig = go.Figure()
-    max_val = max(r_vals) * 1.2 if max(r_vals) > 0 else 10
-
-    # 1. 繪製放射狀虛線 (Axes)
-    for i in range(8):
-        fig.add_trace(go.Scatterpolar(
-            r=[0, max_val],
-            theta=[labels[i], labels[i]],
-            mode='lines',
-            line=dict(color='#94a3b8', width=1, dash='dash'),
-            showlegend=False,
-            hoverinfo='skip'
-        ))
-
-    # 2. 繪製八角形網格
-    for level in [0.2, 0.4, 0.6, 0.8, 1.0]:
-        r_grid = [max_val * level] * 9
-        fig.add_trace(go.Scatterpolar(
-            r=r_grid,
-            theta=labels,
-            mode='lines',
-            line=dict(color='#94a3b8', width=1),
-            showlegend=False,
-            hoverinfo='skip'
-        ))
-
-    # 3. 繪製主要數據
-    fig.add_trace(go.Scatterpolar(
-        r=r_vals,
-        theta=labels,
-        fill='toself',
-        fillcolor='rgba(59, 130, 246, 0.15)',
-        line=dict(color='#2563eb', width=3),
-        marker=dict(size=8, color='#fbbf24')
-    ))
-
-    # 4. 八角色外圍黃色圓點 (裝飾)
-    dot_r = [max_val * 1.02] * 8
-    fig.add_trace(go.Scatterpolar(
-        r=dot_r,
-        theta=labels[:-1],
-        mode='markers',
-        marker=dict(size=10, color='#fbbf24'),
-        showlegend=False,
-        hoverinfo='skip'
-    ))
-
-    fig.update_layout(
-        polar=dict(
-            radialaxis=dict(visible=False, range=[0, max_val * 1.1]),
-            angularaxis=dict(
-                visible=True,
-                showline=False,
-                showgrid=False,
-                tickfont=dict(size=13, color='#e2e8f0'),
-                direction="clockwise",
-                rotation=90,
-            ),
-            bgcolor='rgba(255,255,255,0)'
-        ),
-        annotations=[
-            # 四大能量標籤 (創作者在上，順時針)
-            dict(x=0.5, y=0.73, text="<b>發電機</b>", showarrow=False, font=dict(size=14, color="#fbbf24")),
-            dict(x=0.73, y=0.5, text="<b>火焰</b>", showarrow=False, font=dict(size=14, color="#f87171")),
-            dict(x=0.5, y=0.27, text="<b>節奏</b>", showarrow=False, font=dict(size=14, color="#a78bfa")),
-            dict(x=0.27, y=0.5, text="<b>鋼鐵</b>", showarrow=False, font=dict(size=14, color="#60a5fa")),
-            # 內傾/外傾標籤
-            dict(x=0.35, y=0.32, text="內傾", showarrow=False, font=dict(size=12, color="#94a3b8")),
-            dict(x=0.65, y=0.32, text="外傾", showarrow=False, font=dict(size=12, color="#94a3b8")),
-        ],
-        showlegend=False,
-        margin=dict(l=60, r=60, t=40, b=40),
-        height=450,
-        paper_bgcolor="rgba(0,0,0,0)"
-    )
-    st.plotly_chart(fig, use_container_width=True, config={'staticPlot': True})
+    # 雷達圖：與 PNG、PDF 共用同一份圖元規格，網頁直接輸出 SVG
+    st.markdown(radar_svg(radar_chart_spec(d_pct, b_pct, t_pct, s_pct)), unsafe_allow_html=True)
+    profile_lap("radar")
+
+    if percentile_lines:
+        st.markdown(f"""
+    <div class="card-detail">
+        <div class="card-title">📊 與其他受測者相比</div>
+        {"".join(f"<div>{line}</div>" for line in percentile_lines)}
+    </div>
+    """, unsafe_allow_html=True)
 
     # --- 截圖下載按鈕 ---
-    def generate_result_image():
-        """生成包含所有資訊的結果圖片"""
-        fig_img, axes = plt.subplots(2, 1, figsize=(10, 14), 
-                                      gridspec_kw={'height_ratios': [1.8, 8]},
-                                      facecolor='#0f172a')
-        
-        # 上半部：資訊區
-        ax_info = axes[0]
-        ax_info.set_facecolor('#0f172a')
-        ax_info.axis('off')
-        ax_info.set_xlim(0, 10)
-        ax_info.set_ylim(0, 3)
-        
-        # 姓名
-        ax_info.text(0.3, 2.5, '姓名：', fontsize=16, color='#94a3b8',
-                     fontfamily=CN_FONT_NAME, fontweight='bold', va='center')
-        ax_info.add_patch(plt.Rectangle((1.8, 2.25), 3, 0.55, facecolor='#334155', 
-                                         edgecolor='none', transform=ax_info.transData))
-        ax_info.text(2.0, 2.5, st.session_state.uname, fontsize=16, color='#60a5fa',
-                     fontfamily=CN_FONT_NAME, va='center')
-        
-        # 主要類別
-        ax_info.text(0.3, 1.8, '主要類別：', fontsize=16, color='#94a3b8',
-                     fontfamily=CN_FONT_NAME, fontweight='bold', va='center')
-        ax_info.add_patch(plt.Rectangle((2.5, 1.55), 2.5, 0.55, facecolor='#334155',
-                                         edgecolor='none', transform=ax_info.transData))
-        ax_info.text(2.7, 1.8, profile_short, fontsize=16, color='#60a5fa',
-                     fontfamily=CN_FONT_NAME, va='center')
-        
-        # 標題列
-        ax_info.add_patch(plt.Rectangle((0, 0.8), 10, 0.6, facecolor='#1e3a8a',
-                                         edgecolor='none', transform=ax_info.transData))
-        ax_info.text(5, 1.1, '我的天賦原動力圖表', fontsize=20, color='white',
-                     fontfamily=CN_FONT_NAME, fontweight='bold',
-                     ha='center', va='center')
-        
-        # 能量百分比列
-        ax_info.add_patch(plt.Rectangle((0, 0.2), 10, 0.55, facecolor='#1e293b',
-                                         edgecolor='none', transform=ax_info.transData))
-        energy_labels = [
-            (1.2, f'發電機：{d_pct}%', '#fbbf24'),
-            (3.7, f'火焰：{b_pct}%', '#f87171'),
-            (6.2, f'節奏：{t_pct}%', '#a78bfa'),
-            (8.7, f'鋼鐵：{s_pct}%', '#60a5fa'),
-        ]
-        for ex, etxt, ecol in energy_labels:
-            ax_info.text(ex, 0.47, etxt, fontsize=13, color=ecol,
-                         fontfamily=CN_FONT_NAME, fontweight='bold', va='center')
-        
-        # 下半部：雷達圖
-        ax_radar = axes[1]
-        ax_radar.set_facecolor('#0f172a')
-        
-        # 用極座標重繪雷達圖 (八角色)
-        ax_radar.axis('off')
-        radar_ax = fig_img.add_axes([0.1, 0.05, 0.8, 0.6], polar=True, facecolor='#0f172a')
-        radar_ax.set_theta_zero_location('N')   # 0度在上方
-        radar_ax.set_theta_direction(-1)         # 順時針
-        
-        angles = np.linspace(0, 2 * np.pi, 8, endpoint=False).tolist()
-        r_data = [
-            d_pct, (d_pct + b_pct)/2, b_pct, (b_pct + t_pct)/2,
-            t_pct, (t_pct + s_pct)/2, s_pct, (s_pct + d_pct)/2
-        ]
-        angles += angles[:1]
-        r_data += r_data[:1]
-        
-        radar_labels = ['創作者', '明星', '支持者', '媒合者', '商人', '積蓄者', '地主', '技師']
-        
-        max_v = max(r_data) * 1.2 if max(r_data) > 0 else 10
-        
-        # 網格
-        for lvl in [0.2, 0.4, 0.6, 0.8, 1.0]:
-            grid_r = [max_v * lvl] * 9
-            grid_a = angles
-            radar_ax.plot(grid_a, grid_r, '-', color='#94a3b8', linewidth=0.8)
-        
-        # 放射線
-        for a in angles[:-1]:
-            radar_ax.plot([a, a], [0, max_v], '--', color='#94a3b8', linewidth=0.8)
-        
-        # 數據
-        radar_ax.fill(angles, r_data, color='#2563eb', alpha=0.15)
-        radar_ax.plot(angles, r_data, color='#2563eb', linewidth=2.5)
-        radar_ax.scatter(angles[:-1], r_data[:-1], color='#fbbf24', s=60, zorder=5)
-        
-        # 外圍黃色圓點
-        for a in angles[:-1]:
-            radar_ax.scatter([a], [max_v * 1.02], color='#fbbf24', s=50, zorder=5)
-        
-        radar_ax.set_ylim(0, max_v * 1.1)
-        radar_ax.set_xticks(angles[:-1])
-        radar_ax.set_xticklabels(radar_labels, fontsize=12, color='#e2e8f0',
-                                 fontfamily=CN_FONT_NAME, fontweight='bold')
-        radar_ax.set_yticklabels([])
-        radar_ax.spines['polar'].set_visible(False)
-        radar_ax.grid(False)
-        
-        # 四大能量標籤 (順時針: 上=發電機, 右=火焰, 下=節奏, 左=鋼鐵)
-        radar_ax.text(0, max_v * 0.55, '發電機', fontsize=11, color='#fbbf24',
-                      ha='center', va='center', fontfamily=CN_FONT_NAME, fontweight='bold')
-        radar_ax.text(np.pi/2, max_v * 0.55, '火焰', fontsize=11, color='#f87171',
-                      ha='center', va='center', fontfamily=CN_FONT_NAME, fontweight='bold')
-        radar_ax.text(np.pi, max_v * 0.55, '節奏', fontsize=11, color='#a78bfa',
-                      ha='center', va='center', fontfamily=CN_FONT_NAME, fontweight='bold')
-        radar_ax.text(3*np.pi/2, max_v * 0.55, '鋼鐵', fontsize=11, color='#60a5fa',
-                      ha='center', va='center', fontfamily=CN_FONT_NAME, fontweight='bold')
-        # 內傾/外傾
-        radar_ax.text(np.pi * 1.25, max_v * 0.35, '內傾', fontsize=10, color='#94a3b8',
-                      ha='center', va='center', fontfamily=CN_FONT_NAME)
-        radar_ax.text(np.pi * 0.75, max_v * 0.35, '外傾', fontsize=10, color='#94a3b8',
-                      ha='center', va='center', fontfamily=CN_FONT_NAME)
-        
-        plt.subplots_adjust(hspace=0.05)
-        
-        buf = io.BytesIO()
-        fig_img.savefig(buf, format='png', dpi=150, bbox_inches='tight',
-                        facecolor='#0f172a', edgecolor='none')
-        buf.seek(0)
-        plt.close(fig_img)
-        return buf.getvalue()
-    
-    img_bytes = generate_result_image()
-    st.download_button(
+    artifact_download_button(
+        img_job,
         label="📸 截圖下載",
-        data=img_bytes,
         file_name=f"天賦原動力_{st.session_state.uname}.png",
-        mime="image/png",
-        type="primary"
+        mime="image/png"
     )
-
-
-    # --- 7.5 自動紀錄數據 (僅記錄一次) ---
-    if "logged" not in st.session_state:
-        log_results_to_csv(st.session_state.uname, st.session_state.responses, scores, final_profile)
-        st.session_state.logged = True
+    profile_lap("image_button")
 
     # --- 8. 視覺優化：專業天賦報告卡 (Professional Profile Card) ---
     st.markdown("---")
@@ -976,16 +2534,16 @@ else:
     """, unsafe_allow_html=True)
 
     # --- 9.5 PDF 報告下載 ---
-    # 生成 PDF
-    pdf_bytes = create_pdf(st.session_state.uname, final_profile, p_data, scores)
-    
-    st.download_button(
+    artifact_download_button(
+        pdf_job,
         label="📄 下載完整分析報告 (PDF)",
-        data=pdf_bytes,
         file_name=f"天賦原動力報告_{st.session_state.uname}.pdf",
-        mime="application/pdf",
-        type="primary"
+        mime="application/pdf"
     )
+    retrieval_code = st.session_state.get("report_meta", {}).get("code")
+    if retrieval_code:
+        st.caption(f"🔑 查詢代碼：**{retrieval_code}** (請妥善保存，之後可在「查詢過去的測驗結果」憑此代碼取回本報告)")
+    profile_lap("card_and_pdf")
 
     # --- 10. 詳細分析 (Detailed Breakdown) ---
     st.markdown("---")
@@ -1012,6 +2570,7 @@ else:
             st.info(f"**💡 適合角色**：{detail_data['team_role']}")
             st.markdown(f"**👥 代表人物**：{detail_data['famous']}")
             st.caption(f"最佳拍檔：{detail_data['triangle']} | 相反屬性：{detail_data['opposite']}")
+    profile_lap("tabs")
     
     st.markdown("---")
     if st.button("重新測試 🔄"):
@@ -1020,4 +2579,13 @@ else:
         st.session_state.uname = ""
         if "logged" in st.session_state:
             del st.session_state["logged"]
+        st.session_state.pop("report_meta", None)
+        # 換一個新的續測代號，舊進度不再保留
+        get_checkpoint_store().delete(TENANT["id"], st.session_state.ckpt_token)
+        del st.session_state["ckpt_token"]
         st.rerun()
+
+# 正常跑完的 rerun 在這裡寫出剖析結果
+if PROFILER is not None:
+    st.session_state.pop("profiler", None)
+    PROFILER.finish()